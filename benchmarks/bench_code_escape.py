@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Measure escaping large code blocks with `md_exts.escape_code`, compared to the
+old line-by-line escaping in ActLabTreeProcessor, and check that both produce
+byte-identical html.
+
+	python benchmarks/bench_code_escape.py [line count]
+
+Besides the timed blocks, a few thousand random blocks full of tabs, leading
+whitespace, carriage returns and html special characters are compared.
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyactlab.misc.md_exts import escape_code
+
+def legacy_escape_code(text):
+	"""
+	The escaping ActLabTreeProcessor did before escape_code
+	"""
+	lines = text.split("\n")
+	converted_lines = []
+	for line in lines:
+		line = line.replace("\t", "    ")
+		match = re.match(r'^(\s+)', line)
+		if match:
+			l = len(match.group(1))
+			line = (" " * l) + line[l:]
+		converted_lines.append(line)
+	text = "\n".join(converted_lines)
+
+	return (text.
+		replace("&", "&amp;").
+		replace('"', "&quot;").
+		replace(" ", "&nbsp;").
+		replace("<", "&lt;").
+		replace(">", "&gt;").
+		replace("\r\n", "<br/>").
+		replace("\n", "<br/>")
+	)
+
+def python_block(count):
+	lines = []
+	for i in xrange(count):
+		indent = "    " * (i % 5)
+		lines.append(indent + u'if items[{}] < limit and name != "x{}":  # & more'.format(i, i))
+	return u"\n".join(lines)
+
+def tabbed_block(count):
+	lines = []
+	for i in xrange(count):
+		indent = "\t" * (i % 4)
+		lines.append(indent + u"<item id=\"{}\">\tvalue &amp; {}\t</item>".format(i, i))
+	return u"\n".join(lines)
+
+def random_block(rand, count):
+	chars = u"abcxyz019 \t\r\f\v<>&\"'\u00e9\u2003"
+	indents = [u"", u"", u" ", u"\t", u"  \t", u"\r", u" \f", u"\v\t"]
+	ends = [u"", u"", u"\r", u" ", u"\t"]
+	lines = []
+	for i in xrange(count):
+		body = u"".join(rand.choice(chars) for _ in xrange(rand.randint(0, 60)))
+		lines.append(rand.choice(indents) + body + rand.choice(ends))
+	return u"\n".join(lines)
+
+def check_identical():
+	rand = random.Random(18)
+	blocks = [u"", u"\n", u"\r", u"\r\n", u" \r\n", u"\t\r\n\t", u"a\rb\r\n", u"\v\v x", u"\n\n  \n"]
+	blocks += [random_block(rand, rand.randint(1, 40)) for _ in xrange(3000)]
+	for block in blocks:
+		if escape_code(block) != legacy_escape_code(block):
+			raise Exception("escape_code output differs for {!r}".format(block))
+	print("{} random blocks: identical".format(len(blocks)))
+
+def timed(func, text, repeat=10):
+	start = time.time()
+	for _ in xrange(repeat):
+		func(text)
+	return (time.time() - start) / repeat * 1000.0
+
+def main():
+	count = 20000
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+
+	check_identical()
+
+	blocks = [
+		("python", python_block(count)),
+		("tabbed", tabbed_block(count)),
+		("python crlf", python_block(count).replace(u"\n", u"\r\n")),
+	]
+	for name, text in blocks:
+		if escape_code(text) != legacy_escape_code(text):
+			raise Exception("escape_code output differs for the {} block".format(name))
+
+		legacy_ms = timed(legacy_escape_code, text)
+		new_ms = timed(escape_code, text)
+		print("{:<12} {:>6} lines {:>8.1f} KB   legacy {:>7.2f} ms   escape_code {:>7.2f} ms   {:.1f}x".format(
+			name,
+			count,
+			len(text) / 1024.0,
+			legacy_ms,
+			new_ms,
+			legacy_ms / new_ms
+		))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+Measure the cost of decoding api responses with ActLabClient._auto_convert,
+per response, for large task and notebook listings and for the plain text
+api key response.
+
+	python benchmarks/bench_decode.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyactlab
+from pyactlab import ActLabClient
+
+def make_tasks(count):
+	return json.dumps([{
+		"id": 1000 + i,
+		"task_id": i,
+		"name": "Task number {}".format(i),
+		"body": "<p>" + ("lorem ipsum dolor sit amet " * 20) + "</p>",
+		"is_completed": i % 3 == 0,
+		"priority": 0,
+		"created_on": {"formatted": "Jan 1. 2015", "mysql": "2015-01-01 00:00:00", "timestamp": 1420070400},
+		"created_by": {"id": 1, "name": "Somebody"},
+		"attachments": [],
+	} for i in xrange(count)])
+
+def make_notebooks(count, pages):
+	return json.dumps([{
+		"id": n,
+		"name": "Notebook {}".format(n),
+		"body": "<p>notebook body</p>",
+		"subpages": [{
+			"name": "Page {}".format(p),
+			"permalink": "http://host/index.php?path_info=projects%2Fdemo%2Fnotebooks%2F{}%2Fpages%2F{}".format(n, p),
+			"subpages": [],
+		} for p in xrange(pages)],
+	} for n in xrange(count)])
+
+def legacy_auto_convert(data):
+	"""
+	_auto_convert before it dispatched on the content type
+	"""
+	try:
+		return json.loads(data)
+	except:
+		try:
+			return pyactlab.xmltodict.parse(data)
+		except:
+			return data
+
+def bench(name, fn, number):
+	best = min(timeit.repeat(fn, number=number, repeat=5))
+	print("{:<48} {:>10.1f} us/response".format(name, best / number * 1e6))
+
+def main():
+	client = ActLabClient.__new__(ActLabClient)
+
+	print("json backend: {}".format(pyactlab.json_loads.__module__))
+	print("")
+
+	responses = [
+		("2000 tasks", make_tasks(2000), "application/json", 10),
+		("50 notebooks x 200 pages", make_notebooks(50, 200), "application/json", 10),
+		("api key", "API key: 1-0123456789abcdef0123456789abcdef", "text/plain", 10000),
+	]
+
+	for name, body, content_type, number in responses:
+		print("{} ({} bytes)".format(name, len(body)))
+		bench("  legacy (try json, then xml, then raw)", lambda: legacy_auto_convert(body), number)
+		bench("  _auto_convert, no content type", lambda: client._auto_convert(body), number)
+		bench("  _auto_convert, " + content_type, lambda: client._auto_convert(body, content_type), number)
+		print("")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Measure model construction cost and per-instance memory for Task, Comment
+and Attachment models built from api json.
+
+	python benchmarks/bench_models.py [count]
+"""
+
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyactlab import models
+
+def task_json(i):
+	return {
+		"id": 1000 + i,
+		"task_id": i,
+		"name": u"Task number {}".format(i),
+		"body": u"<p>Some task body</p>",
+		"visibility": 1,
+		"priority": 0,
+		"assignee_id": 3,
+		"milestone_id": None,
+		"is_completed": 0,
+		"created_on": {"formatted": "Jan 1. 2015"},
+		"created_by": {"id": 1, "name": "Somebody"},
+	}
+
+def comment_json(i):
+	return {
+		"id": i,
+		"body": u"<p>A comment</p>",
+		"created_on": {"formatted": "Jan 1. 2015"},
+		"created_by": {"id": 1, "name": "Somebody"},
+	}
+
+def attachment_json(i):
+	return {
+		"id": i,
+		"name": u"screenshot_{}.png".format(i),
+		"size": 12345,
+		"permalink": u"http://host/index.php?path_info=attachments%2F{}".format(i),
+		"mime_type": "image/png",
+	}
+
+def instance_bytes(obj):
+	"""
+	Size of the instance plus the containers it owns to hold its fields
+	(its __dict__, any dicts in it, and the extra fields of accept_all_fields models)
+	"""
+	size = sys.getsizeof(obj)
+	d = getattr(obj, "__dict__", None)
+	if d:
+		size += sys.getsizeof(d)
+		size += sum(sys.getsizeof(v) for v in d.itervalues() if isinstance(v, dict))
+	extra = getattr(obj, "_extra", None)
+	if isinstance(extra, dict):
+		size += sys.getsizeof(extra)
+	return size
+
+def bench(cls, make_json, count):
+	data = [make_json(i) for i in xrange(count)]
+
+	gc.collect()
+	gc.disable()
+	start = time.time()
+	objs = [cls.create(None, d) for d in data]
+	elapsed = time.time() - start
+	gc.enable()
+
+	start = time.time()
+	for o in objs:
+		o.id
+		o.name if hasattr(cls, "name") or "name" in cls.fields else None
+	access = time.time() - start
+
+	print("{:<12} {:>8.2f} us/construct  {:>8.3f} us/2 attribute reads  {:>6} bytes/instance".format(
+		cls.__name__,
+		elapsed / count * 1e6,
+		access / count * 1e6,
+		instance_bytes(objs[-1])
+	))
+	return objs
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	print("{} instances of each model".format(count))
+
+	keep = []
+	keep.append(bench(models.Task, task_json, count))
+	keep.append(bench(models.Comment, comment_json, count))
+	keep.append(bench(models.Attachment, attachment_json, count))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+Measure filling a NameIndex with synthetic task and page names and looking
+them up, compared to scanning every name for the query.
+
+	python benchmarks/bench_name_index.py [name count]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyactlab.index import NameIndex
+
+WORDS = """
+deploy runbook review database failover release notes meeting agenda backup
+restore staging production monitoring alert dashboard migration schema api
+client server cache index search sync daemon hook notebook page task project
+invoice budget planning roadmap onboarding checklist security audit incident
+report weekly monthly quarterly design draft final spec test fix bug feature
+""".split()
+
+def names(count):
+	rand = random.Random(count)
+	res = []
+	for i in xrange(count):
+		words = [rand.choice(WORDS).capitalize()] + [rand.choice(WORDS) for _ in xrange(rand.randint(1, 5))]
+		res.append(u"{} {}".format(" ".join(words), i))
+	return res
+
+def scan(all_names, query):
+	terms = query.lower().split()
+	return [n for n in all_names if all(t in n.lower() for t in terms)]
+
+def timed(func, repeat):
+	start = time.time()
+	for _ in xrange(repeat):
+		res = func()
+	return (time.time() - start) / repeat * 1000.0, res
+
+def main():
+	count = 50000
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+
+	all_names = names(count)
+	index = NameIndex()
+
+	start = time.time()
+	for i, name in enumerate(all_names):
+		kind = "task" if i % 2 == 0 else "page"
+		index.add(kind, 3, i, name)
+	print("added {} names in {:.1f} ms".format(len(index), (time.time() - start) * 1000.0))
+
+	start = time.time()
+	for i in xrange(0, 1000):
+		index.add("task", 3, i * 2, all_names[i * 2] + u" renamed")
+	print("renamed 1000 entries in {:.1f} ms".format((time.time() - start) * 1000.0))
+
+	queries = ["runbook", "deploy runbook", "failover 1234", "renamed", "12345", "db", "zzz"]
+	for query in queries:
+		# the shell asks for at most 11, to list 10 candidates and "..."
+		index_ms, res = timed(lambda: index.search(query, kind="task", parent_id=3, limit=11), 20)
+		count = len(index.search(query, kind="task", parent_id=3))
+		scan_ms, _ = timed(lambda: scan(all_names, query), 3)
+		print("search {!r:<18} {:>6} matches   index {:>8.3f} ms   scan {:>8.2f} ms".format(
+			query,
+			count,
+			index_ms,
+			scan_ms
+		))
+
+	for prefix in [all_names[1][:5], all_names[3][:len(all_names[3]) // 2], all_names[5]]:
+		index_ms, res = timed(lambda: index.complete(prefix, kind="page", parent_id=3, limit=100), 20)
+		print("complete {!r:<38} {:>4} matches   index {:>8.3f} ms".format(prefix, len(res), index_ms))
+
+if __name__ == "__main__":
+	main()
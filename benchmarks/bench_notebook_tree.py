@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+Measure building and querying a NotebookTree for a synthetic notebook, compared
+to the old recursive construction of nested `subpages` lists.
+
+	python benchmarks/bench_notebook_tree.py [page count]
+
+Two notebooks are generated: a bushy one (each page has up to 8 children) and
+a single chain of pages, which the recursive construction can't load at all
+once it is deeper than the recursion limit.
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyactlab import models
+from pyactlab.tree import NotebookTree
+
+PERMALINK = "http://host/index.php?path_info=projects%2Fdemo%2Fnotebooks%2F7%2Fpages%2F{}"
+
+def page_json(page_id):
+	return {
+		"name": u"Page {}".format(page_id),
+		"permalink": PERMALINK.format(page_id),
+		"subpages": [],
+	}
+
+def bushy_notebook(count):
+	random.seed(count)
+	roots = []
+	pages = []
+	for page_id in xrange(1, count + 1):
+		page = page_json(page_id)
+		if len(pages) == 0 or random.random() < 0.05:
+			roots.append(page)
+		else:
+			parent = pages[random.randrange(max(0, len(pages) - 50), len(pages))]
+			if len(parent["subpages"]) >= 8:
+				roots.append(page)
+			else:
+				parent["subpages"].append(page)
+		pages.append(page)
+	return roots
+
+def chain_notebook(count):
+	root = page_json(1)
+	page = root
+	for page_id in xrange(2, count + 1):
+		child = page_json(page_id)
+		page["subpages"].append(child)
+		page = child
+	return [root]
+
+def legacy_build(project_id, notebook_id, json):
+	"""
+	The recursive construction pages used to go through
+	"""
+	match = re.match(r'^.*path_info=projects%2F[a-zA-Z0-9-]+%2Fnotebooks%2F\d+%2Fpages%2F(\d+)', json["permalink"])
+	if match is None:
+		match = re.match(r'^.*/projects/.*/notebooks/[0-9]+/pages/([0-9]+)', json["permalink"])
+	json["id"] = int(match.group(1))
+
+	page = models.Page.create(None, json, project_id=project_id, notebook_id=notebook_id)
+	subpages = []
+	for subpage in json["subpages"]:
+		sub = legacy_build(project_id, notebook_id, subpage)
+		sub.parent_id = json["id"]
+		subpages.append(sub)
+	page.subpages = subpages
+	return page
+
+def legacy_find(pages, page_id):
+	for page in pages:
+		if page.id == page_id:
+			return page
+		res = legacy_find(page.subpages, page_id)
+		if res is not None:
+			return res
+	return None
+
+def strip_ids(pages):
+	stack = list(pages)
+	while len(stack) > 0:
+		page = stack.pop()
+		page.pop("id", None)
+		stack.extend(page["subpages"])
+
+def timed(fn, *args):
+	start = time.time()
+	res = fn(*args)
+	return res, time.time() - start
+
+def report(name, seconds, count=1):
+	print("  {:<32} {:>10.3f} ms".format(name, seconds / count * 1000))
+
+def bench(name, roots, count, lookups):
+	print("{} ({} pages)".format(name, count))
+
+	strip_ids(roots)
+	tree, elapsed = timed(NotebookTree, None, 3, 7, roots)
+	assert len(tree) == count
+	report("NotebookTree build", elapsed)
+
+	ids = [random.randint(1, count) for _ in xrange(lookups)]
+	_, elapsed = timed(lambda: [tree[i] for i in ids])
+	report("tree[id]", elapsed, lookups)
+	_, elapsed = timed(lambda: [tree.path(i) for i in ids])
+	report("tree.path(id)", elapsed, lookups)
+	_, elapsed = timed(lambda: sum(1 for _ in tree.iter_depth_first()))
+	report("depth-first walk", elapsed)
+	_, elapsed = timed(lambda: sum(1 for _ in tree.iter_breadth_first()))
+	report("breadth-first walk", elapsed)
+
+	strip_ids(roots)
+	try:
+		legacy, elapsed = timed(lambda: [legacy_build(3, 7, p) for p in roots])
+	except RuntimeError:
+		print("  {:<32} {:>13}".format("recursive build", "recursion limit"))
+		return
+	report("recursive build", elapsed)
+	_, elapsed = timed(lambda: [legacy_find(legacy, i) for i in ids])
+	report("recursive search for id", elapsed, lookups)
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	bench("bushy notebook", bushy_notebook(count), count, 1000)
+	bench("single chain notebook", chain_notebook(count), count, 100)
+
+if __name__ == "__main__":
+	main()
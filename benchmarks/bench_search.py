@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+Measure filling a SearchIndex with a synthetic multi-year project (tasks,
+pages and their comments, with html bodies) and searching it, compared to
+scanning every body for the query.
+
+	python benchmarks/bench_search.py [task count]
+
+Five comments are made per task and one page per four tasks. Words are
+drawn from a few thousand made-up words with a Zipf distribution, like the
+words of real text, so common words are in most documents and rare ones in
+only a few.
+"""
+
+import bisect
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyactlab.search import SearchIndex, html_text
+
+WORDS = """
+deploy runbook review database failover release notes meeting agenda backup
+restore staging production monitoring alert dashboard migration schema api
+client server cache index search sync daemon hook notebook page task project
+invoice budget planning roadmap onboarding checklist security audit incident
+report weekly monthly quarterly design draft final spec test fix bug feature
+""".split()
+
+SYLLABLES = "ba ce di fo gu ka le mi no pu ra se ti vo zu an er in on ul".split()
+
+def vocabulary(rand, count=4000):
+	"""
+	Return the words and their cumulative Zipf weights
+	"""
+	words = list(WORDS)
+	seen = set(words)
+	while len(words) < count:
+		word = "".join(rand.choice(SYLLABLES) for _ in xrange(rand.randint(2, 4)))
+		if word not in seen:
+			seen.add(word)
+			words.append(word)
+	rand.shuffle(words)
+
+	weights = []
+	total = 0.0
+	for rank in xrange(1, len(words) + 1):
+		total += 1.0 / rank
+		weights.append(total)
+	return words, weights
+
+VOCABULARY = vocabulary(random.Random(0))
+
+def word(rand):
+	words, weights = VOCABULARY
+	return words[bisect.bisect(weights, rand.random() * weights[-1])]
+
+def text(rand, count):
+	return " ".join(word(rand) for _ in xrange(count))
+
+def html(rand, paragraphs):
+	return "".join("<p>{} <b>{}</b> &amp; {}</p>".format(
+		text(rand, 12), word(rand), text(rand, 20)
+	) for _ in xrange(paragraphs))
+
+def project(count):
+	rand = random.Random(count)
+	tasks = []
+	pages = []
+	comments = []
+	for i in xrange(1, count + 1):
+		tasks.append({"task_id": i, "id": 1000 + i, "name": text(rand, 4).capitalize(), "body": html(rand, 3)})
+		for j in xrange(5):
+			comments.append(("projects/3/tasks/{}".format(i), {"id": i * 10 + j, "body": html(rand, 1)}))
+		if i % 4 == 0:
+			pages.append({"id": i, "name": text(rand, 3).capitalize(), "body": html(rand, 8), "notebook": {"id": 1}})
+	return tasks, pages, comments
+
+def timed(func, repeat):
+	start = time.time()
+	for _ in xrange(repeat):
+		res = func()
+	return (time.time() - start) / repeat * 1000.0, res
+
+def main():
+	count = 20000
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+
+	tasks, pages, comments = project(count)
+	tmp = tempfile.mkdtemp()
+	try:
+		index = SearchIndex(os.path.join(tmp, "search.db"))
+
+		start = time.time()
+		for i in xrange(0, len(tasks), 500):
+			index.add_json("task", 3, tasks[i:i + 500])
+		index.add_json("page", 3, pages)
+		by_parent = {}
+		for parent, c in comments:
+			by_parent.setdefault(parent, []).append(c)
+		parents = by_parent.items()
+		for i in xrange(0, len(parents), 100):
+			for parent, cs in parents[i:i + 100]:
+				index.add_json("comment", 3, cs, parent=parent)
+		print("indexed {} documents ({}) in {:.1f} s".format(len(index), index.fts, time.time() - start))
+
+		start = time.time()
+		index.add_json("task", 3, tasks[:1000])
+		print("re-added 1000 unchanged tasks in {:.1f} ms".format((time.time() - start) * 1000.0))
+
+		bodies = [html_text(t["body"]) for t in tasks] + [html_text(p["body"]) for p in pages] + [html_text(c["body"]) for _, c in comments]
+
+		# words of the 1st, 10th, 100th and 1000th most common kind
+		words = VOCABULARY[0]
+		queries = [
+			words[0],
+			words[9],
+			words[99],
+			words[999],
+			words[0] + " " + words[9],
+			words[9] + " " + words[99],
+			words[99] + " " + words[999],
+			words[99][:3],
+			"zzz",
+		]
+		for query in queries:
+			index_ms, res = timed(lambda: index.search(query, project_id=3, limit=20), 10)
+			scan_ms, _ = timed(lambda: [b for b in bodies if all(w in b for w in query.split())], 1)
+			print("search {!r:<24} {:>3} hits   index {:>7.2f} ms   scan {:>8.1f} ms".format(
+				query,
+				len(res),
+				index_ms,
+				scan_ms
+			))
+	finally:
+		shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+	main()
@@ -1,8 +1,16 @@
 import json
+import os
 import re
+import sqlite3
 import urllib
 
 import models
+from cache import ResponseCache
+from multipart import MultipartEncoder, remaining_size
+from search import project_from_path
+from stream import iter_json_array
+from tree import page_id_from_permalink
+from workers import WorkerPool
 
 try:
 	import requests # non-standard, needs to be installed
@@ -13,11 +21,19 @@ except ImportError as e:
 
 try:
 	import xmltodict
+	from xml.parsers.expat import ExpatError
 except ImportError as e:
 	print("xmltodict module is missing")
 	print("run\n\n\tpip install xmltodict\n\nto resolve this error!\n\n")
 	exit
 
+try:
+	# optional, several times faster than the json module at decoding
+	import ujson
+	json_loads = ujson.loads
+except ImportError as e:
+	json_loads = json.loads
+
 class ActLabError(Exception): pass
 class ConnectionError(ActLabError): pass
 class InvalidCredentialsError(ActLabError): pass
@@ -32,16 +48,49 @@ class ActLabClient(object):
 	_client_vendor = "PYACTLAB"
 
 	# TODO - static method to fetch API key from email/password
-	def __init__(self, host, key=None, email=None, password=None, base_path="/"):
+	def __init__(self, host, key=None, email=None, password=None, base_path="/",
+			pool_connections=4, pool_maxsize=10, pool_block=False, max_retries=0,
+			cache=None, search_index=None, check_key=True, timeout=60):
 		"""
+		`pool_connections` is the number of distinct hosts to keep connection pools
+		for, `pool_maxsize` is the number of keep-alive connections kept open per host,
+		and `pool_block` makes threads wait for a free connection instead of opening
+		throw-away connections once `pool_maxsize` is reached.
+
+		`cache` may be a `cache.ResponseCache` (or True for one with the default
+		settings) to cache GET responses in-process.
+
+		`search_index` may be a `search.SearchIndex` (e.g. a Mirror's
+		`search_index`), the tasks, notebooks, pages and comments the client
+		fetches and saves are added to it and can be found with `search`.
+
+		A given `key` is tested with a request unless `check_key` is False.
+
+		Requests fail with a ConnectionError if the server takes longer than
+		`timeout` seconds to accept the connection or to send any data, None
+		waits forever.
 		"""
 		self._host = host
-                self._base_path = base_path
+		self._base_path = base_path
 		self._api_path = self._base_path + "/api.php"
+		self.timeout = timeout
+
+		if cache is True:
+			cache = ResponseCache()
+		self.cache = cache
+		self.search_index = search_index
+
+		self._session = self._create_session(
+			pool_connections=pool_connections,
+			pool_maxsize=pool_maxsize,
+			pool_block=pool_block,
+			max_retries=max_retries
+		)
 
 		if key is not None:
 			self._key = key
-			self._test_key()
+			if check_key:
+				self._test_key()
 		elif email is not None and password is not None:
 			self._key = self._get_api_key(email, password)
 
@@ -116,15 +165,17 @@ class ActLabClient(object):
 		"""
 		Get a list of all visible projects
 		"""
-		res = self._get_cmd("projects")
-		if res is None:
-			return []
+		return list(self.iter_projects(raw=raw))
 
-		if raw:
-			return res
-
-		projects = [models.Project.create(self, p) for p in res]
-		return projects
+	def iter_projects(self, raw=False):
+		"""
+		Yield all visible projects as they are decoded from the response
+		"""
+		for p in self._iter_cmd("projects"):
+			if raw:
+				yield p
+			else:
+				yield models.Project.create_lazy(self, p)
 	
 	def get_project(self, project_id, raw=False):
 		"""
@@ -185,45 +236,71 @@ class ActLabClient(object):
 
 	# TASKS -------------------------
 
-	def _create_task(self, project_id, json):
+	def _create_task(self, project_id, json, lazy=False):
 		"""
-		Create a task from returned json data
+		Create a task from returned json data. Lazy tasks only decode their
+		fields as they are read, see `Model.create_lazy`
 		"""
-		t = models.Task.create(self, json)
+		if lazy:
+			t = models.Task.create_lazy(self, json)
+		else:
+			t = models.Task.create(self, json)
 		t.task_id = json["task_id"]
 		t.project_id = project_id
 		return t
 
 	def get_tasks(self, project_id, raw=False, inc_completed=False):
 		"""
-		Fetch a list of all tasks in a project
+		Fetch a list of all tasks in a project. Raw results always include
+		completed tasks.
 		"""
-		res = self._get_cmd("projects/{pid}/tasks".format(pid=project_id))
-		if res is None:
-			return []
-
 		if raw:
-			return res
+			inc_completed = True
+		return list(self.iter_tasks(project_id, raw=raw, inc_completed=inc_completed))
 
-		tasks = []
-		for t in res:
+	def iter_tasks(self, project_id, raw=False, inc_completed=False):
+		"""
+		Yield the tasks in a project as they are decoded from the response,
+		skipping completed tasks unless `inc_completed` is True
+		"""
+		fetched = []
+		for t in self._iter_cmd("projects/{pid}/tasks".format(pid=project_id)):
+			fetched.append(t)
 			if 1 == t["is_completed"] and not inc_completed:
 				continue
-			task = self._create_task(project_id, t)
-			tasks.append(task)
-		return tasks
+			if raw:
+				yield t
+			else:
+				yield self._create_task(project_id, t, lazy=True)
+		self._index("task", project_id, fetched)
 
 	def get_task(self, project_id, task_id, raw=False):
 		"""
 		Return the task in the project denoted by `project_id` and specified by `task_id`
 		"""
 		res = self._get_cmd("projects/{pid}/tasks/{tid}".format(pid=project_id, tid=task_id))
+		self._index("task", project_id, [res])
 
 		if raw:
 			return res
 
 		return self._create_task(project_id, res)
 	
+	def get_tasks_by_ids(self, project_id, task_ids, raw=False, workers=8):
+		"""
+		Fetch many tasks in the project denoted by `project_id` concurrently, using
+		at most `workers` simultaneous requests.
+
+		Returns a `(tasks, errors)` tuple. `tasks` is in the same order as `task_ids`
+		and holds None for any task that could not be fetched; `errors` maps
+		those task ids to the exception that was raised.
+		"""
+		return self._bulk_fetch(
+			lambda tid: self.get_task(project_id, tid, raw=raw),
+			task_ids,
+			workers
+		)
+
 	def save_task(self, task, **extra):
 		"""
 		Save the existing task
@@ -238,6 +315,7 @@ class ActLabClient(object):
 			"projects/{pid}/tasks/{tid}/edit".format(pid=task.project_id, tid=task.task_id),
 			**fields
 		)
+		self._index("task", task.project_id, [res])
 		return res
 	
 	def complete_task(self, task):
@@ -277,6 +355,7 @@ class ActLabClient(object):
 			"projects/{pid}/tasks/add".format(pid=project_id),
 			**fields
 		)
+		self._index("task", project_id, [res])
 		return self._create_task(project_id, res)
 	
 	# NOTEBOOKS -------------------------
@@ -288,46 +367,34 @@ class ActLabClient(object):
 	def _create_page(self, project_id, notebook_id, json):
 		"""
 		Create a page from the abbreviated json that is returned from
-		in the `subpages` field of a notebook
+		in the `subpages` field of a notebook. The page's body is only fetched
+		when it is first read, and its subpages are only created when they are
+		first accessed.
 		"""
 		if "id" not in json:
-			match = re.match(r'^.*path_info=projects%2F[a-zA-Z0-9-]+%2Fnotebooks%2F\d+%2Fpages%2F(\d+)', json["permalink"])
-                        if match is None:
-                            match = re.match(r'^.*/projects/.*/notebooks/[0-9]+/pages/([0-9]+)', json["permalink"])
-			id = int(match.group(1))
-		else:
-			id = json["id"]
-
-		json["id"] = id
-
-		page = models.Page.create(self, json, project_id=project_id, notebook_id=notebook_id)
-
-		# don't get the full contents yet! do this as-needed perhaps?
-		# page.refresh()
+			json["id"] = self._page_id_from_permalink(json["permalink"])
 
-		subpages = []
-		for subpage in json["subpages"]:
-			page = self._create_page(project_id, subpage)
-			page.parent_id = id
-			subpages.append(page)
-
-		page.subpages = subpages
-		page.project_id = project_id
-		page.notebook_id = notebook_id
+		page = models.Page.create_lazy(self, json, project_id=project_id, notebook_id=notebook_id)
+		page._raw_subpages = json.get("subpages", [])
 
 		return page
 
+	def _page_id_from_permalink(self, permalink):
+		"""
+		Extract the page id from a page's permalink. Abbreviated pages (those in the
+		`subpages` field of a notebook) only have a permalink, not an id.
+		"""
+		return page_id_from_permalink(permalink)
+
 	def _create_notebook(self, project_id, json):
 		"""
-		Create a notebook from the given json, also creating subpages and setting
-		the root page of the notebook.
+		Create a notebook from the given json. Its pages are indexed in
+		`notebook.tree` (see `tree.NotebookTree`) the first time `tree` or
+		`subpages` is accessed.
 		"""
-		notebook = models.Notebook.create(self, json)
-		pages = []
-		for p in json["subpages"]:
-			pages.append(self._create_page(project_id, notebook.id, p))
-		notebook.subpages = pages
-		notebook.project_id = project_id
+		notebook = models.Notebook.create_lazy(self, json, project_id=project_id)
+		# pages are created the first time notebook.subpages is accessed
+		notebook._raw_subpages = json.get("subpages", [])
 
 		return notebook
 
@@ -335,25 +402,27 @@ class ActLabClient(object):
 		"""
 		Fetch a list of all notebooks in a project
 		"""
-		res = self._get_cmd("projects/{pid}/notebooks".format(pid=project_id))
-		if res is None:
-			return []
+		return list(self.iter_notebooks(project_id, raw=raw))
 
-		if raw:
-			return res
-
-		notebooks = []
-		for n in res:
-			notebook = self._create_notebook(project_id, n)
-			notebook.project_id = project_id
-			notebooks.append(notebook)
-		return notebooks
+	def iter_notebooks(self, project_id, raw=False):
+		"""
+		Yield the notebooks in a project as they are decoded from the response
+		"""
+		fetched = []
+		for n in self._iter_cmd("projects/{pid}/notebooks".format(pid=project_id)):
+			fetched.append(n)
+			if raw:
+				yield n
+			else:
+				yield self._create_notebook(project_id, n)
+		self._index("notebook", project_id, fetched)
 
 	def get_notebook(self, project_id, notebook_id, raw=False):
 		"""
 		Return the notebook in the project denoted by `project_id` and specified by `notebook_id`
 		"""
 		res = self._get_cmd("projects/{pid}/notebooks/{nid}".format(pid=project_id, nid=notebook_id))
+		self._index("notebook", project_id, [res])
 
 		if raw:
 			return res
@@ -374,6 +443,7 @@ class ActLabClient(object):
 			"projects/{pid}/notebooks/{nid}/edit".format(pid=notebook.project_id, nid=notebook.id),
 			**fields
 		)
+		self._index("notebook", notebook.project_id, [res])
 		return res
 	
 	def new_notebook(self, project_id, **params):
@@ -395,6 +465,7 @@ class ActLabClient(object):
 			"projects/{pid}/notebooks/add".format(pid=project_id),
 			**fields
 		)
+		self._index("notebook", project_id, [res])
 		return models.Notebook.create(self, res)
 		
 
@@ -425,6 +496,7 @@ class ActLabClient(object):
 			nid=notebook_id,
 			pageid=page_id
 		))
+		self._index("page", project_id, [res], parent=notebook_id or None)
 
 		if raw:
 			return res
@@ -433,6 +505,21 @@ class ActLabClient(object):
 		page.project_id = project_id
 		return page
 	
+	def get_pages_by_ids(self, project_id, page_ids, raw=False, workers=8):
+		"""
+		Fetch many notebook pages in the project denoted by `project_id` concurrently,
+		using at most `workers` simultaneous requests.
+
+		Returns a `(pages, errors)` tuple. `pages` is in the same order as `page_ids`
+		and holds None for any page that could not be fetched; `errors` maps
+		those page ids to the exception that was raised.
+		"""
+		return self._bulk_fetch(
+			lambda pid: self.get_notebook_page(project_id, pid, raw=raw),
+			page_ids,
+			workers
+		)
+
 	def save_notebook_page(self, notebook_page, **extra):
 		""""
 		Save the notebook page
@@ -453,6 +540,7 @@ class ActLabClient(object):
 			),
 			**fields
 		)
+		self._index("page", notebook_page.project_id, [res], parent=notebook_page.notebook_id)
 		return res
 	
 	def new_notebook_page(self, project_id, notebook_id, **params):
@@ -475,6 +563,7 @@ class ActLabClient(object):
 			),
 			**fields
 		)
+		self._index("page", project_id, [res], parent=notebook_id)
 		return models.Page.create(self, res)
 	
 	# MISC -------------------------
@@ -484,21 +573,216 @@ class ActLabClient(object):
 		Download the attachment specified by the url
 		"""
 		dl_url = url + "&auth_api_token=" + self._key
-		res = requests.get(dl_url)
+		try:
+			res = self._session.get(dl_url, timeout=self.timeout)
+		except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+			raise ConnectionError()
 		if res.ok:
 			return res.content
 		else:
 			raise ActLabError("Could not download attachment at {}".format(url))
 	
-	def add_attachment(self, model, name, data, **extra):
+	def download_attachment_to(self, url, dest, size=None, progress=None,
+			chunk_size=64 * 1024, resume=True, retries=3):
 		"""
-		Add an attachment to the model.
+		Stream the attachment specified by the url into `dest`, which may be a file
+		path or a writable file object, `chunk_size` bytes at a time. Memory use does
+		not depend on the size of the attachment.
+
+		A path is downloaded into `dest + ".part"`, which replaces `dest` once it is
+		complete. If `resume` is True and an earlier download left a `.part` file,
+		only the remaining bytes are requested (HTTP Range), as long as the
+		attachment hasn't changed since (If-Range). A dropped connection is resumed
+		the same way up to `retries` times.
+
+		`size` is the expected size in bytes (e.g. `Attachment.size`); an ActLabError
+		is raised if the downloaded size does not match. `progress`, if given, is
+		called as `progress(bytes_done, size)` after each chunk.
+
+		Returns the number of bytes in `dest`.
 		"""
-		model.save(**{"attachments": {"attachment_0": (name, data)}})
+		dl_url = url + "&auth_api_token=" + self._key
+
+		close_dest = False
+		offset = 0
+		# the ETag or Last-Modified of the attachment being downloaded
+		validator = None
+		part = None
+		if isinstance(dest, basestring):
+			path = dest
+			part = path + ".part"
+			if resume and os.path.exists(part):
+				validator = _read_validator(part)
+				if validator is not None:
+					offset = os.path.getsize(part)
+					if size is not None and offset > size:
+						offset = 0
+			dest = open(part, "ab" if offset > 0 else "wb")
+			close_dest = True
+
+		try:
+			while True:
+				if size is not None and offset == size:
+					break
+
+				headers = {}
+				if offset > 0:
+					headers["Range"] = "bytes={}-".format(offset)
+					if validator is not None:
+						# the whole attachment is sent instead if it changed
+						headers["If-Range"] = validator
+
+				try:
+					res = self._session.get(dl_url, headers=headers, stream=True, timeout=self.timeout)
+				except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+					raise ConnectionError()
+
+				try:
+					if res.status_code == 416 and offset > 0:
+						# nothing is left after offset, done if that's the whole attachment
+						if _range_length(res) == offset:
+							break
+						offset = 0
+						dest.seek(0)
+						dest.truncate()
+						continue
+
+					if not res.ok:
+						raise ActLabError("Could not download attachment at {}".format(url))
+
+					# the server ignored the range, start over
+					if offset > 0 and res.status_code != 206:
+						offset = 0
+						dest.seek(0)
+						dest.truncate()
+
+					if offset == 0:
+						validator = _response_validator(res)
+						if part is not None:
+							_write_validator(part, validator)
+
+					start = offset
+					length = res.headers.get("Content-Length")
+					for chunk in res.iter_content(chunk_size):
+						dest.write(chunk)
+						offset += len(chunk)
+						if progress is not None:
+							progress(offset, size)
+					if length is None or offset - start >= int(length):
+						break
+
+					# the connection was closed early without an error
+					retries -= 1
+					if retries < 0:
+						raise ConnectionError()
+
+				except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+						requests.exceptions.Timeout) as e:
+					retries -= 1
+					if retries < 0:
+						raise ConnectionError()
+				finally:
+					res.close()
+		finally:
+			if close_dest:
+				dest.close()
+
+		if size is not None and offset != size:
+			if part is not None:
+				# don't resume from bytes that can't be right
+				_remove_part(part)
+			raise ActLabError("Downloaded {} bytes of attachment at {}, expected {}".format(offset, url, size))
+
+		if part is not None:
+			os.rename(part, path)
+			_remove(part + ".validator")
+
+		return offset
+
+	def add_attachment(self, model, name, data, progress=None, **extra):
+		"""
+		Add an attachment to the model. `data` may be a byte string or a file object
+		open in binary mode, which is streamed instead of being read into memory.
+
+		`progress`, if given, is called as `progress(bytes_sent, total_bytes)` while
+		the upload is sent.
+		"""
+		model.save(**{
+			"attachments": {"attachment_0": (name, data)},
+			"upload_progress": progress
+		})
 	
-	def add_file(self, project, name, data, **extra):
+	def add_attachments(self, model, files, max_batch_bytes=32 * 1024 * 1024, workers=4, progress=None):
+		"""
+		Attach many files to the model. `files` is a list of file paths and/or
+		`(name, data)` tuples, where `data` is a byte string or a file object.
+
+		Files are packed into as few requests as possible (`attachment_0`,
+		`attachment_1`, ...), starting a new request whenever a batch would go over
+		`max_batch_bytes`. Up to `workers` batches are uploaded concurrently. Files
+		are added to a project as separate project files instead.
+
+		`progress`, if given, is called as `progress(bytes_sent, total_bytes)` with
+		the totals across all batches. Returns the number of requests made.
+		"""
+		items = []
+		for f in files:
+			if isinstance(f, basestring):
+				items.append((os.path.basename(f), f, os.path.getsize(f), True))
+			else:
+				name, data = f
+				size = remaining_size(data) if hasattr(data, "read") else len(data)
+				items.append((name, data, size, False))
+
+		if len(items) == 0:
+			return 0
+
+		if isinstance(model, models.Project):
+			# project files are uploaded one per request
+			batches = [[item] for item in items]
+		else:
+			batches = [[]]
+			batch_size = 0
+			for item in items:
+				if len(batches[-1]) > 0 and batch_size + item[2] > max_batch_bytes:
+					batches.append([])
+					batch_size = 0
+				batches[-1].append(item)
+				batch_size += item[2]
+
+		total = sum(item[2] for item in items)
+		sent = {}
+		def batch_progress(idx):
+			if progress is None:
+				return None
+			batch_bytes = sum(item[2] for item in batches[idx])
+			def report(batch_sent, batch_total):
+				# scale the encoded body size back down to the size of the files
+				sent[idx] = batch_sent * batch_bytes // max(batch_total, 1)
+				progress(sum(sent.values()), total)
+			return report
+
+		pool = WorkerPool(min(workers, len(batches)), name="pyactlab-attach")
+		try:
+			futures = [
+				pool.submit(self._upload_batch, model, batch, batch_progress(idx))
+				for idx, batch in enumerate(batches)
+			]
+			results = [future.result() for future in futures]
+		finally:
+			pool.shutdown()
+
+		if not isinstance(model, models.Project):
+			merged = self._merge_attachments(results)
+			if merged is not None:
+				model._create_fields(merged)
+
+		return len(batches)
+
+	def add_file(self, project, name, data, progress=None, **extra):
 		"""
-		Add a file to the project
+		Add a file to the project. `data` and `progress` are the same as
+		with `add_attachment`
 		"""
 		cmd = self._get_model_url(project) + "/files/files/upload"
 
@@ -508,12 +792,59 @@ class ActLabClient(object):
 			"submitted": "submitted",
 			"attachments": {
 				"attachment_0": (name, data)
-			}
+			},
+			"upload_progress": progress
 		}
 		res = self._post_cmd(cmd, **fields)
 
 		return models.File.create(self, res)
 	
+	def _upload_batch(self, model, batch, progress):
+		"""
+		Upload a batch of `(name, path_or_data, size, is_path)` attachments to the
+		model in a single request. Returns the raw response.
+		"""
+		opened = []
+		try:
+			files = {}
+			for idx, (name, data, size, is_path) in enumerate(batch):
+				if is_path:
+					data = open(data, "rb")
+					opened.append(data)
+				files["attachment_{}".format(idx)] = (name, data)
+
+			if isinstance(model, models.Project):
+				name, data = files["attachment_0"]
+				return self.add_file(model, name, data, progress=progress)
+
+			return getattr(self, "save_" + model.method)(
+				model,
+				attachments=files,
+				upload_progress=progress
+			)
+		finally:
+			for f in opened:
+				f.close()
+
+	def _merge_attachments(self, results):
+		"""
+		Return the last of the save `results`, with the attachments of all of
+		them. Batches finish in any order, so no single response is sure to have
+		every attachment.
+		"""
+		results = [res for res in results if res is not None]
+		if len(results) == 0:
+			return None
+
+		attachments = {}
+		for res in results:
+			for attachment in res.get("attachments") or []:
+				attachments[attachment["id"]] = attachment
+
+		merged = dict(results[-1])
+		merged["attachments"] = [attachments[k] for k in sorted(attachments)]
+		return merged
+
 	def download_file(self, file_obj):
 		"""
 		Download the file, given a file model
@@ -533,20 +864,21 @@ class ActLabClient(object):
 		"""
 		Return a list of comments attached to the model
 		"""
-		cmd = self._get_model_url(model) + "/comments"
-
-		res = self._get_cmd(cmd)
-		if res is None:
-			return []
-
-		if raw:
-			return res
-
-		comments = []
-		for c in res:
-			comments.append(models.Comment.create(self, c))
+		return list(self.iter_comments(model, raw=raw))
 
-		return comments
+	def iter_comments(self, model, raw=False):
+		"""
+		Yield the comments attached to the model as they are decoded from the response
+		"""
+		parent = self._get_model_url(model)
+		fetched = []
+		for c in self._iter_cmd(parent + "/comments"):
+			fetched.append(c)
+			if raw:
+				yield c
+			else:
+				yield models.Comment.create_lazy(self, c)
+		self._index("comment", project_from_path(parent), fetched, parent=parent)
 	
 	def add_comment(self, model, msg, raw=False):
 		"""
@@ -559,12 +891,27 @@ class ActLabClient(object):
 		}
 
 		res = self._post_cmd(cmd, **fields)
+		parent = self._get_model_url(model)
+		self._index("comment", project_from_path(parent), [res], parent=parent)
 
 		if raw:
 			return res
 
 		return models.Comment.create(self, res)
 
+	# SEARCH -------------------------
+
+	def search(self, query, project_id=None, kinds=None, limit=20):
+		"""
+		Return the best `limit` matches for `query` among the tasks, notebooks,
+		pages and comments in the search index (optionally only those in
+		`project_id` and of `kinds`) as `search.SearchHit`s, each with the model's
+		kind and id
+		"""
+		if self.search_index is None:
+			raise ActLabError("The client has no search index")
+		return self.search_index.search(query, project_id=project_id, kinds=kinds, limit=limit)
+
 	# ---------------------
 	# ---------------------
 
@@ -574,6 +921,12 @@ class ActLabClient(object):
 		"""
 		return self._key
 
+	def close(self):
+		"""
+		Close all pooled connections. The client can not be used afterwards.
+		"""
+		self._session.close()
+
 	# ------------------------
 	#  UTILITY
 	# ------------------------
@@ -589,6 +942,46 @@ class ActLabClient(object):
 
 		return cmd
 
+	def _index(self, kind, project_id, items, parent=None):
+		"""
+		Add the raw json `items` of `kind` to the search index, if there is one.
+		The index is only a local cache, failing to update it (e.g. while another
+		process holds the database) doesn't fail the api call that was made.
+		"""
+		if self.search_index is None:
+			return
+		try:
+			self.search_index.add_json(kind, project_id, [i for i in items if isinstance(i, dict)], parent=parent)
+		except sqlite3.Error as e:
+			self._debug("Could not update the search index: {}".format(e))
+
+	def _bulk_fetch(self, fetch, ids, workers):
+		"""
+		Call `fetch(id)` for each id on a pool of `workers` threads. Returns a
+		`(results, errors)` tuple, see `get_tasks_by_ids`
+		"""
+		ids = list(ids)
+		results = [None] * len(ids)
+		errors = {}
+		if len(ids) == 0:
+			return results, errors
+
+		pool = WorkerPool(min(workers, len(ids)), name="pyactlab-bulk")
+		try:
+			futures = pool.map(fetch, ids)
+			for idx, future in enumerate(futures):
+				exc = future.exception()
+				if exc is not None:
+					errors[ids[idx]] = exc
+				elif future.result() is None:
+					errors[ids[idx]] = ActLabError("Could not fetch {}".format(ids[idx]))
+				else:
+					results[idx] = future.result()
+		finally:
+			pool.shutdown()
+
+		return results, errors
+
 	def _memberify_dict(self, d, body_name, excludeNone=True):
 		"""
 		Memberify key values in a dictionary with the body_name.
@@ -599,7 +992,7 @@ class ActLabClient(object):
 		for k,v in d.iteritems():
 			if v is None and excludeNone:
 				continue
-			if k == "attachments":
+			if k in ["attachments", "upload_progress"]:
 				res[k] = v
 			else:
 				res["{p}[{k}]".format(p=body_name, k=k)] = v
@@ -624,18 +1017,59 @@ class ActLabClient(object):
 		"""
 		return "&".join("{k}={v}".format(k=k, v=self._esc(v)) for k,v in d.iteritems())
 	
-	def _auto_convert(self, data):
-		try:
-			return json.loads(data)
-		except:
-			try:
-				return xmltodict.parse(data)
-			except:
+	def _auto_convert(self, data, content_type=None):
+		"""
+		Decode a response body according to its `content_type`. Bodies with no
+		recognized content type are tried as json, then xml, then returned as-is.
+		"""
+		if content_type is not None:
+			content_type = content_type.lower()
+			if "json" in content_type:
+				try:
+					return json_loads(data)
+				except ValueError as e:
+					raise ActLabError("Could not decode json response: {}".format(e))
+			elif "xml" in content_type:
+				try:
+					return xmltodict.parse(data)
+				except ExpatError as e:
+					raise ActLabError("Could not decode xml response: {}".format(e))
+			elif content_type.startswith("text/"):
 				return data
 
+		try:
+			return json_loads(data)
+		except ValueError:
+			pass
+
+		try:
+			return xmltodict.parse(data)
+		except ExpatError:
+			pass
+
+		return data
+
 	# ------------------------
 	#  PRIVATE CORE
 	# ------------------------
+
+	def _create_session(self, pool_connections, pool_maxsize, pool_block, max_retries):
+		"""
+		Create the `requests.Session` that all api calls go through. The session
+		keeps connections (and their TLS sessions) alive between calls. The
+		underlying urllib3 pools are thread-safe, so one session is shared by
+		every thread using this client.
+		"""
+		session = requests.Session()
+		adapter = requests.adapters.HTTPAdapter(
+			pool_connections=pool_connections,
+			pool_maxsize=pool_maxsize,
+			pool_block=pool_block,
+			max_retries=max_retries
+		)
+		session.mount("http://", adapter)
+		session.mount("https://", adapter)
+		return session
 	
 	def _api_url(self, **params):
 		"""
@@ -655,13 +1089,30 @@ class ActLabClient(object):
 
 		url = self._api_url(**query_params)
 
+		cache_key = None
+		entry = None
+		headers = {}
+		if self.cache is not None:
+			cache_key = self.cache.make_key(query_params)
+			entry = self.cache.lookup(cache_key)
+			if entry is not None:
+				if entry.is_fresh():
+					return self._auto_convert(entry.content, entry.content_type)
+				headers = entry.validators()
+
 		try:
-			res = requests.get(url)
-		except requests.exceptions.ConnectionError as e:
+			res = self._session.get(url, headers=headers, timeout=self.timeout)
+		except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
 			raise ConnectionError()
 
+		if res.status_code == 304 and entry is not None:
+			self.cache.revalidated(cache_key)
+			return self._auto_convert(entry.content, entry.content_type)
+
 		if res.ok:
-			return self._auto_convert(res.content)
+			if cache_key is not None:
+				self.cache.store(cache_key, query_params.get("path_info", ""), res.content, res.headers)
+			return self._auto_convert(res.content, res.headers.get("Content-Type"))
 		else:
 			return None
 	
@@ -672,20 +1123,25 @@ class ActLabClient(object):
 		if query_params is None: query_params = {}
 		if post_params is None: post_params = {}
 
-		files = []
-		if "attachments" in post_params:
-			files = post_params["attachments"]
-			del post_params["attachments"]
+		files = post_params.pop("attachments", None)
+		progress = post_params.pop("upload_progress", None)
 
 		url = self._api_url(**query_params)
 
+		data = post_params
+		headers = {}
+		if files:
+			# stream the body instead of building it in memory
+			data = MultipartEncoder(post_params, files, progress=progress)
+			headers["Content-Type"] = data.content_type
+
 		try:
-			res = requests.post(url, post_params, files=files)
-		except requests.exceptions.ConnectionError as e:
+			res = self._session.post(url, data=data, headers=headers, timeout=self.timeout)
+		except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
 			raise ConnectionError()
 
 		if res.ok:
-			return self._auto_convert(res.content)
+			return self._auto_convert(res.content, res.headers.get("Content-Type"))
 		else:
 			return None
 	
@@ -697,13 +1153,60 @@ class ActLabClient(object):
 		}
 	
 	def _post_cmd(self, cmd, **params):
-		return self._post_api(self._make_cmd_params(cmd), params)
+		res = self._post_api(self._make_cmd_params(cmd), params)
+		if self.cache is not None:
+			self.cache.invalidate(cmd)
+		return res
 	
 	def _get_cmd(self, cmd, **params):
 		url_params = self._make_cmd_params(cmd)
 		url_params = dict(url_params.items() + params.items())
 		return self._get_api(url_params)
 
+	def _iter_cmd(self, cmd, chunk_size=64 * 1024):
+		"""
+		Yield the items of the json array returned by `cmd` as they are decoded
+		from the response stream, `chunk_size` bytes at a time. With the response
+		cache enabled the full response is needed anyway, so it is fetched and
+		decoded through `_get_cmd` instead.
+		"""
+		if self.cache is not None:
+			res = self._get_cmd(cmd)
+			if isinstance(res, list):
+				for item in res:
+					yield item
+			return
+
+		url = self._api_url(**self._make_cmd_params(cmd))
+		try:
+			res = self._session.get(url, stream=True, timeout=self.timeout)
+		except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+			raise ConnectionError()
+
+		try:
+			if not res.ok:
+				return
+
+			content_type = res.headers.get("Content-Type")
+			if content_type is None or "json" not in content_type.lower():
+				data = self._auto_convert(res.content, content_type)
+				if isinstance(data, list):
+					for item in data:
+						yield item
+				return
+
+			items = iter_json_array(res.iter_content(chunk_size), json_loads)
+			while True:
+				try:
+					item = next(items)
+				except StopIteration:
+					break
+				except ValueError as e:
+					raise ActLabError("Could not decode json response: {}".format(e))
+				yield item
+		finally:
+			res.close()
+
 	def _test_key(self):
 		"""
 		Test the validity of the api key by fetching a list of companies
@@ -734,3 +1237,57 @@ class ActLabClient(object):
 		else:
 			self._debug("Could not extract API key from " + json.dumps(res))
 			return None
+
+def _response_validator(res):
+	"""
+	Return the strong ETag or the Last-Modified date of a response, whichever
+	can be sent as If-Range, or None
+	"""
+	etag = res.headers.get("ETag")
+	if etag is not None and not etag.startswith("W/"):
+		return etag
+	return res.headers.get("Last-Modified")
+
+def _range_length(res):
+	"""
+	Return the full length from a 416 response's `Content-Range: bytes */N`, or
+	None
+	"""
+	match = re.match(r'^bytes \*/(\d+)$', res.headers.get("Content-Range", "").strip())
+	if match is None:
+		return None
+	return int(match.group(1))
+
+def _read_validator(part):
+	"""
+	Return the validator saved next to a partial download, or None
+	"""
+	try:
+		with open(part + ".validator", "rb") as f:
+			return f.read().strip() or None
+	except IOError:
+		return None
+
+def _write_validator(part, validator):
+	"""
+	Save the validator of a partial download next to it, so that it can be
+	resumed later. Without one it can't be.
+	"""
+	if validator is None:
+		_remove(part + ".validator")
+		return
+	with open(part + ".validator", "wb") as f:
+		f.write(validator)
+
+def _remove_part(part):
+	"""
+	Remove a partial download and its validator
+	"""
+	_remove(part)
+	_remove(part + ".validator")
+
+def _remove(path):
+	if os.path.exists(path):
+		os.remove(path)
+
+from async_client import AsyncActLabClient
@@ -0,0 +1,89 @@
+import functools
+
+from workers import WorkerPool, gather
+
+class AsyncActLabClient(object):
+	"""
+	Concurrent twin of ActLabClient. Every public method of ActLabClient is
+	available here with the same arguments, but returns a `workers.Future`
+	instead of blocking. The futures resolve to the same `pyactlab.models`
+	objects (or raw json) that ActLabClient returns.
+
+	At most `max_concurrency` calls are in flight at once; everything else is
+	queued, so thousands of calls can be submitted and collected with `gather`
+	without creating a thread per request:
+
+		aclient = AsyncActLabClient(host, key=key, max_concurrency=16)
+		futures = [aclient.get_task(pid, tid) for tid in task_ids]
+		tasks = aclient.gather(futures)
+	"""
+
+	def __init__(self, host=None, key=None, email=None, password=None, base_path="/",
+			max_concurrency=10, client=None, **client_kwargs):
+		"""
+		Wrap `client` if provided, otherwise create a new ActLabClient whose
+		connection pool is sized to `max_concurrency`
+		"""
+		if client is None:
+			# avoid a circular import, pyactlab imports this module
+			from pyactlab import ActLabClient
+
+			client_kwargs.setdefault("pool_maxsize", max_concurrency)
+			client = ActLabClient(
+				host,
+				key=key,
+				email=email,
+				password=password,
+				base_path=base_path,
+				**client_kwargs
+			)
+
+		self.client = client
+		self.max_concurrency = max_concurrency
+		self._pool = WorkerPool(max_concurrency, name="pyactlab-async")
+
+	def submit(self, fn, *args, **kwargs):
+		"""
+		Run any callable (e.g. `model.save`) on the client's workers and return
+		its Future
+		"""
+		return self._pool.submit(fn, *args, **kwargs)
+
+	def gather(self, futures, return_exceptions=False, timeout=None):
+		"""
+		Wait for all `futures` and return their results in order. See `workers.gather`
+		"""
+		return gather(futures, return_exceptions=return_exceptions, timeout=timeout)
+
+	def close(self):
+		"""
+		Wait for queued calls to finish, then stop the workers and close the
+		wrapped client's connections
+		"""
+		self._pool.shutdown(wait=True)
+		self.client.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def __getattr__(self, k):
+		"""
+		Mirror the public methods of the wrapped client, returning Futures
+		"""
+		if k.startswith("_"):
+			raise AttributeError(k)
+
+		attr = getattr(self.client, k)
+		if not callable(attr):
+			return attr
+
+		@functools.wraps(attr)
+		def submit_call(*args, **kwargs):
+			return self._pool.submit(attr, *args, **kwargs)
+
+		# cache it so the wrapper is only built once per method
+		setattr(self, k, submit_call)
+		return submit_call
@@ -0,0 +1,335 @@
+import collections
+import re
+import threading
+import time
+
+# (path_info regex, ttl in seconds) - the first matching rule wins
+DEFAULT_TTLS = [
+	(r'^people(/\d+)?$', 600),
+	(r'^people/\d+/users', 600),
+	(r'^projects$', 300),
+]
+
+class CacheEntry(object):
+	"""
+	A single cached api response
+	"""
+
+	__slots__ = ("path", "content", "content_type", "etag", "last_modified", "expires")
+
+	def __init__(self, path, content, content_type, etag, last_modified, expires):
+		"""
+		"""
+		self.path = path
+		self.content = content
+		self.content_type = content_type
+		self.etag = etag
+		self.last_modified = last_modified
+		self.expires = expires
+
+	def is_fresh(self, now=None):
+		"""
+		Return True if the entry's ttl has not run out yet
+		"""
+		if now is None:
+			now = time.time()
+		return now < self.expires
+
+	def validators(self):
+		"""
+		Return the conditional-GET headers that can be used to revalidate a stale entry
+		"""
+		headers = {}
+		if self.etag is not None:
+			headers["If-None-Match"] = self.etag
+		if self.last_modified is not None:
+			headers["If-Modified-Since"] = self.last_modified
+		return headers
+
+class ResponseCache(object):
+	"""
+	In-process cache of raw api responses keyed on `path_info` plus the other
+	query params. Entries expire after a per-endpoint ttl, are revalidated with
+	ETag/Last-Modified when the server provided them, and are evicted least
+	recently used first once the cached bodies exceed `max_bytes`.
+
+	Entries for a resource, anything below it and the collections above it are
+	invalidated whenever the client writes to that resource.
+	"""
+
+	def __init__(self, max_bytes=16 * 1024 * 1024, default_ttl=60, ttls=None):
+		"""
+		`ttls` is a list of `(path_info regex, seconds)` rules checked in order
+		before falling back to `default_ttl`. Defaults to `DEFAULT_TTLS`.
+		"""
+		if ttls is None:
+			ttls = DEFAULT_TTLS
+
+		self.max_bytes = max_bytes
+		self.default_ttl = default_ttl
+		self._ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+		self._entries = collections.OrderedDict()
+		self._size = 0
+		self._lock = threading.Lock()
+		self._stats = {
+			"hits":			0,	# fresh entry was returned
+			"misses":		0,	# nothing cached, full request made
+			"revalidated":	0,	# stale entry confirmed by a 304
+			"stale":		0,	# stale entry replaced by a new response
+			"evictions":	0,	# entries dropped to stay under max_bytes
+			"invalidations": 0,	# entries dropped because of a write
+		}
+
+	def make_key(self, query_params):
+		"""
+		Build the cache key for the query params of a GET request. The api token
+		is left out of the key.
+		"""
+		return tuple(sorted(
+			(k, unicode(v)) for k,v in query_params.iteritems()
+			if k != "auth_api_token"
+		))
+
+	def ttl_for(self, path):
+		"""
+		Return the ttl to use for responses from the endpoint at `path`
+		"""
+		for regex, ttl in self._ttls:
+			if regex.match(path):
+				return ttl
+		return self.default_ttl
+
+	def lookup(self, key):
+		"""
+		Return the entry cached under `key`, fresh or stale, or None
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self._stats["misses"] += 1
+				return None
+
+			# mark it as most recently used
+			del self._entries[key]
+			self._entries[key] = entry
+
+			if entry.is_fresh():
+				self._stats["hits"] += 1
+			return entry
+
+	def store(self, key, path, content, headers):
+		"""
+		Cache the response `content` for `key`. `headers` are the response headers,
+		used for the content type and the revalidation headers.
+		"""
+		entry = CacheEntry(
+			path=path,
+			content=content,
+			content_type=headers.get("Content-Type"),
+			etag=headers.get("ETag"),
+			last_modified=headers.get("Last-Modified"),
+			expires=time.time() + self.ttl_for(path)
+		)
+
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self._size -= len(old.content)
+				self._stats["stale"] += 1
+
+			if len(content) > self.max_bytes:
+				return
+
+			self._entries[key] = entry
+			self._size += len(content)
+			self._evict()
+
+	def revalidated(self, key):
+		"""
+		The server confirmed the entry for `key` is still current (304), restart its ttl
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return
+			entry.expires = time.time() + self.ttl_for(entry.path)
+			self._stats["revalidated"] += 1
+
+	def invalidate(self, cmd):
+		"""
+		Drop everything a write to `cmd` (e.g. `projects/3/tasks/5/edit`) may have
+		changed: the resource itself, anything below it and the collections above it.
+		"""
+		parts = cmd.strip("/").split("/")
+		# strip the trailing action (edit, complete, add, upload, ...)
+		if len(parts) > 1 and not parts[-1].isdigit():
+			parts = parts[:-1]
+		resource = "/".join(parts)
+
+		ancestors = set("/".join(parts[:idx]) for idx in xrange(1, len(parts)))
+		norm_resource = self._normalize(resource)
+
+		with self._lock:
+			for key, entry in self._entries.items():
+				norm_path = self._normalize(entry.path)
+				if (entry.path in ancestors
+						or norm_path == norm_resource
+						or norm_path.startswith(norm_resource + "/")):
+					del self._entries[key]
+					self._size -= len(entry.content)
+					self._stats["invalidations"] += 1
+
+	def clear(self):
+		"""
+		Drop all cached entries
+		"""
+		with self._lock:
+			self._entries.clear()
+			self._size = 0
+
+	def stats(self):
+		"""
+		Return a copy of the hit/miss counters, plus the current entry count and size
+		"""
+		with self._lock:
+			res = self._stats.copy()
+			res["entries"] = len(self._entries)
+			res["bytes"] = self._size
+		return res
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _normalize(self, path):
+		"""
+		Pages can be fetched through any notebook id (see `get_notebook_page`), so
+		compare page paths without it
+		"""
+		return re.sub(r'notebooks/\d+/pages/', 'notebooks/*/pages/', path)
+
+	def _evict(self):
+		"""
+		Drop least recently used entries until the cache fits in `max_bytes`.
+		Must be called with the lock held.
+		"""
+		while self._size > self.max_bytes and len(self._entries) > 0:
+			key, entry = self._entries.popitem(last=False)
+			self._size -= len(entry.content)
+			self._stats["evictions"] += 1
+
+class ListCache(object):
+	"""
+	Lists of models keyed by `(kind, parent id)`, e.g. `("tasks", 3)` for the
+	tasks of project 3, that expire `ttl` seconds after they were stored.
+
+	Used by the shell so listing the same thing again doesn't go back to the
+	server. Models changed locally are written through with `upsert` and
+	`remove` instead of throwing the whole list away.
+	"""
+
+	def __init__(self, ttl=300):
+		"""
+		"""
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		# (kind, parent id) -> (expires, [models])
+		self._lists = {}
+		self._stats = {
+			"hits":		0,
+			"misses":	0,
+			"expired":	0,
+		}
+
+	def get(self, kind, parent_id):
+		"""
+		Return a copy of the cached list, or None if it isn't cached or has expired
+		"""
+		with self._lock:
+			entry = self._lists.get((kind, parent_id))
+			if entry is None:
+				self._stats["misses"] += 1
+				return None
+
+			expires, models = entry
+			if time.time() >= expires:
+				del self._lists[(kind, parent_id)]
+				self._stats["expired"] += 1
+				return None
+
+			self._stats["hits"] += 1
+			return list(models)
+
+	def put(self, kind, parent_id, models):
+		"""
+		Cache `models` as the list of `kind` in `parent_id`
+		"""
+		with self._lock:
+			self._lists[(kind, parent_id)] = (time.time() + self.ttl, list(models))
+
+	def upsert(self, kind, parent_id, model, id_field="id"):
+		"""
+		Replace the model with the same `id_field` in the cached list, or append
+		it if it isn't in the list yet. Nothing happens if the list isn't cached,
+		the list is dropped if the model has no id.
+		"""
+		model_id = getattr(model, id_field)
+		with self._lock:
+			entry = self._lists.get((kind, parent_id))
+			if entry is None:
+				return
+			if model_id is None:
+				del self._lists[(kind, parent_id)]
+				return
+
+			models = entry[1]
+			for idx, m in enumerate(models):
+				if getattr(m, id_field) == model_id:
+					models[idx] = model
+					break
+			else:
+				models.append(model)
+
+	def remove(self, kind, parent_id, model, id_field="id"):
+		"""
+		Remove the model with the same `id_field` from the cached list
+		"""
+		model_id = getattr(model, id_field)
+		with self._lock:
+			entry = self._lists.get((kind, parent_id))
+			if entry is None:
+				return
+			entry[1][:] = [m for m in entry[1] if getattr(m, id_field) != model_id]
+
+	def invalidate(self, kind=None, parent_id=None, parent_prefix=None):
+		"""
+		Drop the cached lists of `kind` (all kinds if None) in `parent_id` (all
+		parents if None). `parent_prefix` only drops the lists whose parent is an
+		api path starting with it, e.g. the comments in `projects/3/`.
+		"""
+		with self._lock:
+			for key in self._lists.keys():
+				if kind is not None and key[0] != kind:
+					continue
+				if parent_id is not None and key[1] != parent_id:
+					continue
+				if parent_prefix is not None and not (
+						isinstance(key[1], basestring) and key[1].startswith(parent_prefix)):
+					continue
+				del self._lists[key]
+
+	def clear(self):
+		"""
+		Drop all cached lists
+		"""
+		with self._lock:
+			self._lists.clear()
+
+	def stats(self):
+		"""
+		Return a copy of the hit/miss counters, plus the number of cached lists
+		"""
+		with self._lock:
+			res = self._stats.copy()
+			res["lists"] = len(self._lists)
+		return res
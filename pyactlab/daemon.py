@@ -0,0 +1,528 @@
+import hashlib
+import json
+import os
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+
+from pyactlab import ActLabError
+from sync import SyncEngine, SyncItem, SyncManifest
+from workers import WorkerPool
+
+# created next to the .actlab config
+SOCKET_NAME = ".actlab.sock"
+OUTBOX_NAME = ".actlab.outbox"
+MANIFEST_NAME = ".actlab.manifest"
+
+class DaemonUnavailableError(ActLabError): pass
+
+def socket_path(root):
+	"""
+	Return the path of the socket the daemon for the project rooted at `root` listens on
+	"""
+	return os.path.join(root, SOCKET_NAME)
+
+def send(path, request, timeout=30):
+	"""
+	Send a single json `request` to the daemon listening on the unix socket at
+	`path` and return its decoded response. Raises DaemonUnavailableError if no
+	daemon is listening.
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.settimeout(timeout)
+	try:
+		sock.connect(path)
+	except socket.error as e:
+		sock.close()
+		raise DaemonUnavailableError("no daemon listening on {}: {}".format(path, e))
+
+	try:
+		sock.sendall(json.dumps(request) + "\n")
+		line = sock.makefile("rb").readline()
+	except socket.error as e:
+		raise DaemonUnavailableError("lost the connection to the daemon: {}".format(e))
+	finally:
+		sock.close()
+
+	if not line:
+		raise DaemonUnavailableError("the daemon closed the connection")
+	return json.loads(line)
+
+class Outbox(object):
+	"""
+	Durable queue of pending writes, one json file per resource (project,
+	notebook or page) in `directory`. Queuing new values for a resource that
+	is already waiting merges them into its job, so the last write to each
+	field wins and a resource is only saved once however often it changes.
+
+	Job files are written to a temp file, fsync'd and renamed into place, so
+	queued writes survive the daemon or the machine going down.
+	"""
+
+	def __init__(self, directory):
+		"""
+		Load any jobs left in `directory` by a previous run
+		"""
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		self._lock = threading.Lock()
+		self._jobs = {}
+		self._seq = 0
+
+		for name in os.listdir(directory):
+			path = os.path.join(directory, name)
+			if name.startswith(self._TEMP_PREFIX):
+				# a write that never made it to the rename
+				os.remove(path)
+				continue
+			if not name.endswith(".json"):
+				# e.g. a .corrupt job, kept for the user to look at
+				continue
+			try:
+				with open(path, "rb") as f:
+					job = json.load(f)
+				key, seq = job["key"], job["seq"]
+			except (ValueError, KeyError, TypeError):
+				os.rename(path, path + ".corrupt")
+				continue
+			self._jobs[key] = job
+			self._seq = max(self._seq, seq)
+
+	def __len__(self):
+		with self._lock:
+			return len(self._jobs)
+
+	def put(self, items):
+		"""
+		Queue the values of `items`, which must all update the same resource
+		"""
+		first = items[0]
+		key = _resource_key(first)
+		with self._lock:
+			job = self._jobs.get(key)
+			if job is None:
+				job = {
+					"key":			key,
+					"project_id":	first.project_id,
+					"notebook_id":	first.notebook_id,
+					"page_id":		first.page_id,
+					"fields":		{},
+					"queued_on":	time.time(),
+				}
+			else:
+				# copy it, the old version may be being pushed right now
+				job = dict(job, fields=dict(job["fields"]))
+
+			for item in items:
+				job["fields"][item.field] = {"fname": item.fname, "value": item.value}
+
+			self._seq += 1
+			job["seq"] = self._seq
+			job["attempts"] = 0
+			job["next_try"] = 0
+			job["last_error"] = None
+
+			self._write(job)
+			self._jobs[key] = job
+
+	def is_pending(self, item):
+		"""
+		Return True if a value for `item`'s field is waiting to be pushed
+		"""
+		with self._lock:
+			job = self._jobs.get(_resource_key(item))
+			return job is not None and item.field in job["fields"]
+
+	def due(self, now, exclude=()):
+		"""
+		Return a `(jobs, next_try)` tuple of the jobs that should be tried at
+		`now` (skipping keys in `exclude`), and the time the next job after them
+		is due, or None
+		"""
+		res = []
+		next_try = None
+		with self._lock:
+			for key, job in self._jobs.iteritems():
+				if key in exclude:
+					continue
+				if job["next_try"] <= now:
+					res.append(job)
+				elif next_try is None or job["next_try"] < next_try:
+					next_try = job["next_try"]
+		res.sort(key=lambda job: job["seq"])
+		return res, next_try
+
+	def done(self, job):
+		"""
+		`job` was pushed, remove it unless newer values were queued in the meantime
+		"""
+		with self._lock:
+			curr = self._jobs.get(job["key"])
+			if curr is not None and curr["seq"] == job["seq"]:
+				del self._jobs[job["key"]]
+				os.remove(self._path(job["key"]))
+
+	def failed(self, job, error, delay):
+		"""
+		`job` could not be pushed, try it again in `delay` seconds
+		"""
+		with self._lock:
+			curr = self._jobs.get(job["key"])
+			if curr is None or curr["seq"] != job["seq"]:
+				# newer values were queued, they will be tried right away
+				return
+			curr["attempts"] += 1
+			curr["next_try"] = time.time() + delay
+			curr["last_error"] = error
+			self._write(curr)
+
+	def retry_all(self):
+		"""
+		Make every waiting job due now
+		"""
+		with self._lock:
+			for job in self._jobs.itervalues():
+				if job["next_try"] != 0:
+					job["next_try"] = 0
+					self._write(job)
+
+	def jobs(self):
+		"""
+		Return a snapshot of all waiting jobs, oldest first
+		"""
+		with self._lock:
+			res = [dict(job) for job in self._jobs.itervalues()]
+		res.sort(key=lambda job: job["seq"])
+		return res
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	# job files are written to temp files starting with this first
+	_TEMP_PREFIX = ".job."
+
+	def _path(self, key):
+		return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + ".json")
+
+	def _write(self, job):
+		fd, tmp_path = tempfile.mkstemp(prefix=self._TEMP_PREFIX, dir=self.directory)
+		try:
+			with os.fdopen(fd, "wb") as f:
+				json.dump(job, f)
+				f.flush()
+				os.fsync(f.fileno())
+			os.rename(tmp_path, self._path(job["key"]))
+		except:
+			os.remove(tmp_path)
+			raise
+
+class ActLabDaemon(object):
+	"""
+	Long-lived local sync process for one actlab project directory. Hooks hand
+	it changed files and shells the fields they save over a unix socket (see
+	`send`) and return immediately. Files are rendered and checked against the
+	sync manifest right away, changed values go to the durable `Outbox`, and
+	are pushed in the background on a warm client, retrying failed pushes with
+	exponential backoff.
+
+	Requests and responses are single lines of json:
+
+		{"cmd": "sync", "root": "/path/to/git/root", "files": ["notes/a.md"]}
+		{"cmd": "save", "items": [{"fname": "page 11", "project_id": 3,
+			"notebook_id": 7, "page_id": 11, "field": "body", "value": "..."}]}
+		{"cmd": "status"}
+		{"cmd": "retry"}
+		{"cmd": "ping"}
+		{"cmd": "stop"}
+	"""
+
+	def __init__(self, root, client_factory, mirror=None, render=None, workers=4,
+			retry_delay=5, max_retry_delay=600):
+		"""
+		`root` is the directory holding the `.actlab` config, the socket, outbox
+		and manifest are kept there. `client_factory` creates the ActLabClient,
+		it is called again until it succeeds so the daemon can start while the
+		server is unreachable. `mirror` and `render` are passed to SyncEngine.
+		"""
+		self.root = root
+		self.mirror = mirror
+		self.render = render
+		self.workers = workers
+		self.retry_delay = retry_delay
+		self.max_retry_delay = max_retry_delay
+
+		self.outbox = Outbox(os.path.join(root, OUTBOX_NAME))
+		self.manifest = SyncManifest(os.path.join(root, MANIFEST_NAME))
+
+		self._client_factory = client_factory
+		self._client = None
+		self._client_lock = threading.Lock()
+		self._lock = threading.Lock()
+		self._wakeup = threading.Condition(threading.Lock())
+		self._woken = False
+		self._in_flight = set()
+		self._pool = WorkerPool(workers, name="actlabd")
+		self._server = None
+		self._stopping = False
+		self._started_on = time.time()
+		self._stats = {
+			"pushed":	0,	# jobs saved to the server
+			"failures":	0,	# failed push attempts
+			"skipped":	0,	# files that were unchanged
+		}
+
+	def serve_forever(self, path=None):
+		"""
+		Listen on the unix socket at `path` (see `socket_path`) until a stop request
+		"""
+		if path is None:
+			path = socket_path(self.root)
+		self._remove_stale_socket(path)
+
+		self._server = _Server(path, _Handler)
+		self._server.actlabd = self
+		os.chmod(path, 0600)
+
+		dispatcher = threading.Thread(target=self._dispatch, name="actlabd-dispatch")
+		dispatcher.daemon = True
+		dispatcher.start()
+
+		self._log("listening on {}, {} queued".format(path, len(self.outbox)))
+		try:
+			self._server.serve_forever()
+		finally:
+			self._stopping = True
+			self._notify()
+			self._server.server_close()
+			if os.path.exists(path):
+				os.remove(path)
+			self._pool.shutdown(wait=True)
+			self._log("stopped")
+
+	def handle(self, request):
+		"""
+		Handle a single decoded request, returning the response
+		"""
+		cmd = request.get("cmd")
+		if cmd == "sync":
+			res = self.queue_files(request.get("root") or self.root, request.get("files", []))
+		elif cmd == "save":
+			res = self.queue_items(request.get("items", []))
+		elif cmd == "status":
+			res = self.status()
+		elif cmd == "retry":
+			self.outbox.retry_all()
+			self._notify()
+			res = {}
+		elif cmd == "ping":
+			res = {}
+		elif cmd == "stop":
+			# shutdown() waits for serve_forever to return, which needs this handler to finish
+			threading.Thread(target=self._server.shutdown).start()
+			res = {}
+		else:
+			return {"ok": False, "error": "unknown command {!r}".format(cmd)}
+
+		res["ok"] = True
+		return res
+
+	def queue_files(self, root, fnames):
+		"""
+		Render `fnames` (relative to `root`) and queue the ones that changed
+		"""
+		engine = SyncEngine(None, root, render=self.render)
+		items, errors = engine.collect(fnames)
+
+		groups = {}
+		skipped = []
+		for item in items:
+			# a pending write may need to be overwritten even with the pushed value
+			with self._lock:
+				current = self.manifest.is_current(item)
+			if current and not self.outbox.is_pending(item):
+				skipped.append(item.fname)
+				continue
+			groups.setdefault(item.resource, []).append(item)
+
+		queued = []
+		for group in groups.itervalues():
+			self.outbox.put(group)
+			queued.extend(item.fname for item in group)
+
+		with self._lock:
+			self._stats["skipped"] += len(skipped)
+
+		if len(queued) > 0:
+			self._log("queued {}".format(", ".join(queued)))
+			self._notify()
+
+		return {
+			"queued":	queued,
+			"skipped":	skipped,
+			"errors":	[{"file": fname, "error": msg} for fname, msg in errors],
+		}
+
+	def queue_items(self, items):
+		"""
+		Queue field values saved by a shell, dicts with a `fname` describing
+		where they came from, the ids of the model (see SyncItem), the `field`
+		and its `value`. They are always queued, unchanged or not.
+		"""
+		groups = {}
+		for item in items:
+			item = SyncItem(
+				item["fname"],
+				item["project_id"],
+				item.get("notebook_id"),
+				item.get("page_id"),
+				item["field"],
+				item["value"]
+			)
+			groups.setdefault(item.resource, []).append(item)
+
+		queued = []
+		for group in groups.itervalues():
+			self.outbox.put(group)
+			queued.extend(item.fname for item in group)
+
+		if len(queued) > 0:
+			self._log("queued {}".format(", ".join(sorted(set(queued)))))
+			self._notify()
+
+		return {"queued": queued}
+
+	def status(self):
+		"""
+		Return the queue depth, counters and the jobs that have failed
+		"""
+		now = time.time()
+		failing = []
+		for job in self.outbox.jobs():
+			if job["attempts"] == 0:
+				continue
+			failing.append({
+				"files":		sorted(f["fname"] for f in job["fields"].itervalues()),
+				"attempts":		job["attempts"],
+				"last_error":	job["last_error"],
+				"retry_in":		max(0, int(job["next_try"] - now)),
+			})
+
+		with self._lock:
+			res = dict(self._stats)
+			res["in_flight"] = len(self._in_flight)
+		res["connected"] = self._client is not None
+		res["queued"] = len(self.outbox)
+		res["failing"] = failing
+		res["uptime"] = int(now - self._started_on)
+		return res
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _dispatch(self):
+		"""
+		Hand due jobs to the workers, sleeping until the next one is due or
+		new work is queued
+		"""
+		while not self._stopping:
+			with self._lock:
+				in_flight = set(self._in_flight)
+			jobs, next_try = self.outbox.due(time.time(), exclude=in_flight)
+
+			for job in jobs:
+				with self._lock:
+					self._in_flight.add(job["key"])
+				self._pool.submit(self._push, job)
+
+			with self._wakeup:
+				if not self._woken and not self._stopping:
+					timeout = 60
+					if next_try is not None:
+						timeout = min(timeout, max(0.1, next_try - time.time()))
+					self._wakeup.wait(timeout)
+				self._woken = False
+
+	def _push(self, job):
+		items = [
+			SyncItem(f["fname"], job["project_id"], job["notebook_id"], job["page_id"], field, f["value"])
+			for field, f in job["fields"].iteritems()
+		]
+		try:
+			engine = SyncEngine(self._get_client(), self.root, mirror=self.mirror)
+			name = engine.push(items)
+		except Exception as e:
+			delay = min(self.max_retry_delay, self.retry_delay * (2 ** job["attempts"]))
+			self.outbox.failed(job, str(e), delay)
+			with self._lock:
+				self._stats["failures"] += 1
+			self._log("push of {} failed ({}), retrying in {}s".format(job["key"], e, delay))
+		else:
+			with self._lock:
+				for item in items:
+					self.manifest.record(item)
+				self.manifest.save()
+				self._stats["pushed"] += 1
+			self.outbox.done(job)
+			self._log("synced {} with '{}'".format(", ".join(item.fname for item in items), name))
+		finally:
+			with self._lock:
+				self._in_flight.discard(job["key"])
+			self._notify()
+
+	def _get_client(self):
+		with self._client_lock:
+			if self._client is None:
+				self._client = self._client_factory()
+			return self._client
+
+	def _notify(self):
+		with self._wakeup:
+			self._woken = True
+			self._wakeup.notify()
+
+	def _remove_stale_socket(self, path):
+		if not os.path.exists(path):
+			return
+		try:
+			send(path, {"cmd": "ping"}, timeout=2)
+		except DaemonUnavailableError:
+			os.remove(path)
+		else:
+			raise ActLabError("a daemon is already listening on {}".format(path))
+
+	def _log(self, msg):
+		print("{} actlabd: {}".format(time.strftime("%Y-%m-%d %H:%M:%S"), msg))
+		sys.stdout.flush()
+
+class _Server(SocketServer.ThreadingUnixStreamServer):
+	daemon_threads = True
+
+class _Handler(SocketServer.StreamRequestHandler):
+	"""
+	One json request per line, each answered with one json response line
+	"""
+
+	def handle(self):
+		for line in self.rfile:
+			if line.strip() == "":
+				continue
+			try:
+				res = self.server.actlabd.handle(json.loads(line))
+			except Exception as e:
+				res = {"ok": False, "error": str(e)}
+			self.wfile.write(json.dumps(res) + "\n")
+			self.wfile.flush()
+
+def _resource_key(item):
+	return "{}:{}:{}".format(
+		item.project_id,
+		"" if item.notebook_id is None else item.notebook_id,
+		"" if item.page_id is None else item.page_id
+	)
@@ -0,0 +1,250 @@
+import heapq
+import re
+import threading
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+class NameEntry(object):
+	"""
+	A named model in a NameIndex
+	"""
+
+	__slots__ = ("kind", "parent_id", "id", "name", "lower")
+
+	def __init__(self, kind, parent_id, id, name):
+		"""
+		"""
+		self.kind = kind
+		self.parent_id = parent_id
+		self.id = id
+		self.name = name
+		self.lower = name.lower()
+
+	@property
+	def key(self):
+		return (self.kind, self.parent_id, self.id)
+
+class NameIndex(object):
+	"""
+	In-memory index of model names (companies, projects, tasks, notebooks and
+	pages) for finding models by part of their name.
+
+	Each entry is identified by its kind, its parent's id (the project of a
+	task or notebook, the notebook of a page, None for companies and projects)
+	and the id used to select it (the task_id of tasks). Entries of the same
+	kind and parent are indexed together by the trigrams of their names and the
+	one and two character prefixes of their words, so a lookup only looks at
+	entries that have every gram of the query.
+	"""
+
+	def __init__(self):
+		"""
+		"""
+		self._lock = threading.Lock()
+		# (kind, parent_id, id) -> NameEntry
+		self._entries = {}
+		# (kind, parent_id) -> {trigram or short word prefix: set of keys}
+		self._scopes = {}
+
+	def __len__(self):
+		return len(self._entries)
+
+	def add(self, kind, parent_id, id, name):
+		"""
+		Add (or rename) the entry for a model
+		"""
+		if id is None or not name:
+			return
+		if isinstance(name, str):
+			name = name.decode("utf-8", "replace")
+
+		entry = NameEntry(kind, parent_id, id, name)
+		key = entry.key
+		with self._lock:
+			old = self._entries.get(key)
+			if old is not None:
+				if old.name == name:
+					return
+				self._unindex(old)
+			self._entries[key] = entry
+
+			grams = self._scopes.get((kind, parent_id))
+			if grams is None:
+				grams = self._scopes[(kind, parent_id)] = {}
+			for gram in _grams(entry.lower):
+				keys = grams.get(gram)
+				if keys is None:
+					keys = grams[gram] = set()
+				keys.add(key)
+
+	def add_models(self, kind, parent_id, models, id_field="id"):
+		"""
+		Add an entry for each model in `models`
+		"""
+		for model in models:
+			self.add(kind, parent_id, getattr(model, id_field), model.name)
+
+	def remove(self, kind, parent_id, id):
+		"""
+		Remove the entry for a model, if there is one
+		"""
+		with self._lock:
+			entry = self._entries.pop((kind, parent_id, id), None)
+			if entry is not None:
+				self._unindex(entry)
+
+	def has(self, kind, parent_id):
+		"""
+		Return True if any entries of `kind` in `parent_id` have been added
+		"""
+		with self._lock:
+			return len(self._scopes.get((kind, parent_id), ())) > 0
+
+	def search(self, query, kind=None, parent_id=None, limit=None):
+		"""
+		Return the entries whose names contain every word of `query` (ignoring
+		case), optionally only those of `kind` in `parent_id`. Words shorter
+		than three characters only match the start of words in the name.
+
+		The best matches come first: exact names, then names starting with the
+		query, then names with a word starting with it, shorter names before
+		longer ones.
+		"""
+		# decoded first, str.lower() leaves non-ascii bytes alone
+		if isinstance(query, str):
+			query = query.decode("utf-8", "replace")
+		query = query.strip().lower()
+		terms = query.split()
+		if len(terms) == 0:
+			return []
+
+		query_grams = set()
+		for term in terms:
+			query_grams.update(_query_grams(term))
+
+		entries = []
+		with self._lock:
+			for scope, grams in self._scopes.iteritems():
+				if kind is not None and scope[0] != kind:
+					continue
+				if parent_id is not None and scope[1] != parent_id:
+					continue
+				entries.extend(self._entries[k] for k in self._lookup(grams, query_grams))
+
+		# grams can match without the terms being in the name
+		if len(terms) == 1:
+			res = [e for e in entries if query in e.lower]
+		else:
+			res = [e for e in entries if all(term in e.lower for term in terms)]
+
+		rank = lambda e: (_rank(e.lower, query), len(e.lower), e.lower, e.id)
+		if limit is not None and limit < len(res):
+			return heapq.nsmallest(limit, res, key=rank)
+		res.sort(key=rank)
+		return res
+
+	def complete(self, prefix, kind=None, parent_id=None, limit=None):
+		"""
+		Return the entries whose names start with `prefix` (ignoring case), in
+		name order
+		"""
+		if isinstance(prefix, str):
+			prefix = prefix.decode("utf-8", "replace")
+		lower = prefix.lower()
+
+		if lower.strip() == "":
+			with self._lock:
+				entries = [e for e in self._entries.itervalues()
+					if (kind is None or e.kind == kind) and (parent_id is None or e.parent_id == parent_id)]
+		else:
+			entries = [e for e in self.search(lower, kind=kind, parent_id=parent_id) if e.lower.startswith(lower)]
+
+		order = lambda e: (e.lower, e.id)
+		if limit is not None and limit < len(entries):
+			return heapq.nsmallest(limit, entries, key=order)
+		entries.sort(key=order)
+		return entries
+
+	def clear(self):
+		"""
+		Remove all entries
+		"""
+		with self._lock:
+			self._entries.clear()
+			self._scopes.clear()
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _lookup(self, grams, query_grams):
+		"""
+		Return the keys in a scope's `grams` that have all of `query_grams`. Must
+		be called with the lock held.
+		"""
+		if len(query_grams) == 0:
+			# nothing but punctuation in the query
+			keys = set()
+			for found in grams.itervalues():
+				keys.update(found)
+			return keys
+
+		sets = []
+		for gram in query_grams:
+			found = grams.get(gram)
+			if found is None:
+				return ()
+			sets.append(found)
+
+		# intersect the smallest sets first
+		sets.sort(key=len)
+		return sets[0].intersection(*sets[1:])
+
+	def _unindex(self, entry):
+		"""
+		Remove `entry`'s grams. Must be called with the lock held.
+		"""
+		scope = (entry.kind, entry.parent_id)
+		grams = self._scopes.get(scope)
+		if grams is None:
+			return
+
+		for gram in _grams(entry.lower):
+			keys = grams.get(gram)
+			if keys is not None:
+				keys.discard(entry.key)
+				if len(keys) == 0:
+					del grams[gram]
+		if len(grams) == 0:
+			del self._scopes[scope]
+
+def _grams(lower):
+	"""
+	Return the set of grams a lowercase name is indexed by: its trigrams and
+	the one and two character prefixes of its words (marked with a leading
+	space so they don't collide with trigrams)
+	"""
+	res = set(lower[i:i + 3] for i in xrange(len(lower) - 2))
+	for word in _WORD_RE.findall(lower):
+		res.add(u" " + word[:1])
+		res.add(u" " + word[:2])
+	return res
+
+def _query_grams(term):
+	"""
+	Return the grams an entry must have for `term` to be in its name
+	"""
+	if len(term) >= 3:
+		return set(term[i:i + 3] for i in xrange(len(term) - 2))
+
+	# a short term can only be found through the words it starts
+	return set(u" " + w for w in _WORD_RE.findall(term))
+
+def _rank(lower, query):
+	if lower == query:
+		return 0
+	if lower.startswith(query):
+		return 1
+	if u" " + query in lower:
+		return 2
+	return 3
@@ -0,0 +1,534 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import models
+from search import SearchIndex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+	id			INTEGER PRIMARY KEY,
+	updated_on	TEXT,
+	json		TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+	project_id		INTEGER NOT NULL,
+	task_id			INTEGER NOT NULL,
+	id				INTEGER,
+	is_completed	INTEGER NOT NULL DEFAULT 0,
+	updated_on		TEXT,
+	json			TEXT NOT NULL,
+	PRIMARY KEY (project_id, task_id)
+);
+CREATE TABLE IF NOT EXISTS notebooks (
+	project_id	INTEGER NOT NULL,
+	id			INTEGER NOT NULL,
+	updated_on	TEXT,
+	json		TEXT NOT NULL,
+	PRIMARY KEY (project_id, id)
+);
+CREATE TABLE IF NOT EXISTS pages (
+	project_id	INTEGER NOT NULL,
+	id			INTEGER NOT NULL,
+	notebook_id	INTEGER NOT NULL,
+	updated_on	TEXT,
+	json		TEXT NOT NULL,
+	PRIMARY KEY (project_id, id)
+);
+CREATE TABLE IF NOT EXISTS comments (
+	parent		TEXT NOT NULL,
+	id			INTEGER NOT NULL,
+	json		TEXT NOT NULL,
+	PRIMARY KEY (parent, id)
+);
+CREATE TABLE IF NOT EXISTS attachments (
+	parent		TEXT NOT NULL,
+	id			INTEGER NOT NULL,
+	name		TEXT,
+	size		INTEGER,
+	permalink	TEXT,
+	json		TEXT NOT NULL,
+	PRIMARY KEY (parent, id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+	project_id	INTEGER PRIMARY KEY,
+	synced_on	REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS converted (
+	key			TEXT PRIMARY KEY,
+	value		TEXT NOT NULL
+);
+"""
+
+# number of the most recently stored html conversions that are kept
+MAX_CONVERTED = 10000
+
+class Mirror(object):
+	"""
+	Local SQLite mirror of Active Collab projects: tasks, notebooks, pages,
+	comments and attachment metadata. The raw api json is stored, so models
+	built from the mirror are identical to ones built from the server.
+
+	The database uses WAL journaling and a busy timeout, so shells, hooks and
+	other processes in the same repo can read and sync it at the same time.
+	Each thread gets its own connection.
+
+	Everything mirrored is also added to `search_index` (see
+	`search.SearchIndex`), which is kept in the same database.
+	"""
+
+	def __init__(self, path, timeout=30.0):
+		"""
+		Open (creating if needed) the mirror database at `path`
+		"""
+		self.path = os.path.abspath(os.path.expanduser(path))
+		self._timeout = timeout
+		self._local = threading.local()
+
+		conn = self._conn()
+		conn.executescript(SCHEMA)
+		conn.commit()
+
+		self.search_index = SearchIndex(connect=self._conn)
+		if self.search_index.created:
+			# a mirror from before there was a search index
+			self.reindex()
+
+	# ---------------------------------
+	# SYNCING
+	# ---------------------------------
+
+	def sync(self, client, project_id, full=False, workers=8):
+		"""
+		Bring the mirror of project `project_id` up to date. Only tasks, notebooks
+		and pages whose `updated_on` differs from the mirrored copy (or that are new)
+		are fetched in full; records that no longer exist remotely are removed.
+		If `full` is True, everything is re-fetched.
+
+		Returns a dict of how many records of each kind were fetched.
+		"""
+		counts = {"tasks": 0, "notebooks": 0, "pages": 0, "removed": 0}
+
+		project = client.get_project(project_id, raw=True)
+		if project is None:
+			return counts
+
+		task_list = client.get_tasks(project_id, raw=True) or []
+		notebook_list = client.get_notebooks(project_id, raw=True) or []
+
+		known_tasks = {} if full else self._stamps("tasks", "task_id", project_id)
+		changed_tasks = [
+			t["task_id"] for t in task_list
+			if known_tasks.get(t["task_id"], -1) != _stamp(t.get("updated_on"))
+		]
+
+		known_notebooks = {} if full else self._stamps("notebooks", "id", project_id)
+		changed_notebooks = [
+			n for n in notebook_list
+			if known_notebooks.get(n["id"], -1) != _stamp(n.get("updated_on"))
+		]
+
+		# abbreviated pages don't always carry updated_on, so every page of a changed
+		# notebook is re-fetched along with any page the mirror hasn't seen yet
+		known_pages = {} if full else self._stamps("pages", "id", project_id)
+		changed_notebook_ids = set(n["id"] for n in changed_notebooks)
+		page_notebooks = {}
+		changed_pages = []
+		for n in notebook_list:
+			for page_id, stamp in _walk_pages(client, n.get("subpages", [])):
+				page_notebooks[page_id] = n["id"]
+				if (n["id"] in changed_notebook_ids
+						or page_id not in known_pages
+						or (stamp is not None and known_pages[page_id] != stamp)):
+					changed_pages.append(page_id)
+
+		tasks, _ = client.get_tasks_by_ids(project_id, changed_tasks, raw=True, workers=workers)
+		pages, _ = client.get_pages_by_ids(project_id, changed_pages, raw=True, workers=workers)
+
+		task_comments = self._fetch_comments(client, [
+			"projects/{}/tasks/{}".format(project_id, t["task_id"]) for t in tasks if t is not None
+		], workers)
+		page_comments = self._fetch_comments(client, [
+			"projects/{}/notebook_pages/{}".format(project_id, p["id"]) for p in pages if p is not None
+		], workers)
+
+		conn = self._conn()
+		with conn:
+			# serialize concurrent syncs of the same database
+			conn.execute("BEGIN IMMEDIATE")
+
+			self._put_project(conn, project)
+
+			for t in tasks:
+				if t is None:
+					continue
+				self._put_task(conn, project_id, t)
+				counts["tasks"] += 1
+
+			for n in changed_notebooks:
+				self._put_notebook(conn, project_id, n)
+				counts["notebooks"] += 1
+
+			for p in pages:
+				if p is None:
+					continue
+				self._put_page(conn, project_id, page_notebooks.get(p["id"]), p)
+				counts["pages"] += 1
+
+			for parent, comments in task_comments.items() + page_comments.items():
+				self._put_comments(conn, parent, comments)
+
+			counts["removed"] += self._remove_missing(
+				conn, "tasks", "task_id", project_id, [t["task_id"] for t in task_list], "task"
+			)
+			counts["removed"] += self._remove_missing(
+				conn, "notebooks", "id", project_id, [n["id"] for n in notebook_list], "notebook"
+			)
+			counts["removed"] += self._remove_missing(
+				conn, "pages", "id", project_id, page_notebooks.keys(), "page"
+			)
+
+			conn.execute(
+				"INSERT OR REPLACE INTO sync_state (project_id, synced_on) VALUES (?, ?)",
+				(project_id, time.time())
+			)
+
+		return counts
+
+	def last_sync(self, project_id):
+		"""
+		Return the unix time project `project_id` was last synced, or None if it
+		has never been synced
+		"""
+		row = self._conn().execute(
+			"SELECT synced_on FROM sync_state WHERE project_id = ?", (project_id,)
+		).fetchone()
+		return None if row is None else row[0]
+
+	def has_project(self, project_id):
+		"""
+		Return True if project `project_id` has been synced into the mirror
+		"""
+		return self.last_sync(project_id) is not None
+
+	def update_model(self, model):
+		"""
+		Write-through a model that was saved locally so the mirror doesn't go
+		stale until the next sync
+		"""
+		project_id = getattr(model, "project_id", None)
+		if isinstance(model, models.Project):
+			project_id = model.id
+		if project_id is None or model.id is None or not self.has_project(project_id):
+			return
+
+		conn = self._conn()
+		with conn:
+			conn.execute("BEGIN IMMEDIATE")
+			if isinstance(model, models.Project):
+				self._merge(conn, "projects", "id = ?", (model.id,), model, self._put_project)
+			elif isinstance(model, models.Task):
+				self._merge(conn, "tasks", "project_id = ? AND task_id = ?", (project_id, model.task_id),
+					model, lambda c, j: self._put_task(c, project_id, j))
+			elif isinstance(model, models.Notebook):
+				self._merge(conn, "notebooks", "project_id = ? AND id = ?", (project_id, model.id),
+					model, lambda c, j: self._put_notebook(c, project_id, j))
+			elif isinstance(model, models.Page):
+				self._merge(conn, "pages", "project_id = ? AND id = ?", (project_id, model.id),
+					model, lambda c, j: self._put_page(c, project_id, model.notebook_id, j))
+
+	# ---------------------------------
+	# READING
+	# ---------------------------------
+
+	def get_project(self, project_id):
+		"""
+		Return the raw json of project `project_id`, or None
+		"""
+		return self._one("SELECT json FROM projects WHERE id = ?", (project_id,))
+
+	def get_projects(self):
+		"""
+		Return the raw json of all mirrored projects
+		"""
+		return self._all("SELECT json FROM projects ORDER BY id", ())
+
+	def get_tasks(self, project_id, inc_completed=False):
+		"""
+		Return the raw json of the tasks in project `project_id`
+		"""
+		sql = "SELECT json FROM tasks WHERE project_id = ?"
+		if not inc_completed:
+			sql += " AND is_completed = 0"
+		return self._all(sql + " ORDER BY task_id", (project_id,))
+
+	def get_task(self, project_id, task_id):
+		"""
+		Return the raw json of task `task_id` in project `project_id`, or None
+		"""
+		return self._one(
+			"SELECT json FROM tasks WHERE project_id = ? AND task_id = ?",
+			(project_id, task_id)
+		)
+
+	def get_notebooks(self, project_id):
+		"""
+		Return the raw json of the notebooks (with abbreviated subpages) in project `project_id`
+		"""
+		return self._all("SELECT json FROM notebooks WHERE project_id = ? ORDER BY id", (project_id,))
+
+	def get_notebook(self, project_id, notebook_id):
+		"""
+		Return the raw json of notebook `notebook_id` in project `project_id`, or None
+		"""
+		return self._one(
+			"SELECT json FROM notebooks WHERE project_id = ? AND id = ?",
+			(project_id, notebook_id)
+		)
+
+	def get_page(self, project_id, page_id):
+		"""
+		Return the raw json of the full page `page_id` in project `project_id`, or None
+		"""
+		return self._one(
+			"SELECT json FROM pages WHERE project_id = ? AND id = ?",
+			(project_id, page_id)
+		)
+
+	def get_comments(self, parent):
+		"""
+		Return the raw json of the comments on the model at the api path `parent`
+		(e.g. `projects/3/tasks/5`), or None if they have not been mirrored
+		"""
+		rows = self._all("SELECT json FROM comments WHERE parent = ? ORDER BY id", (parent,))
+		if len(rows) == 0:
+			return None
+		return rows
+
+	def get_attachments(self, parent):
+		"""
+		Return the raw json of the attachments on the model at the api path `parent`
+		"""
+		return self._all("SELECT json FROM attachments WHERE parent = ? ORDER BY id", (parent,))
+
+	# ---------------------------------
+	# CONVERSIONS
+	# ---------------------------------
+
+	def get_converted(self, key):
+		"""
+		Return the cached conversion of a value (see `misc.deprocess.HtmlConverter`)
+		stored under `key`, or None
+		"""
+		row = self._conn().execute("SELECT value FROM converted WHERE key = ?", (key,)).fetchone()
+		return None if row is None else row[0]
+
+	def put_converted(self, key, value):
+		"""
+		Cache the conversion `value` under `key`. Keys are made from the value
+		that was converted, so edited values leave their old conversions behind,
+		only the MAX_CONVERTED most recently stored ones are kept.
+		"""
+		conn = self._conn()
+		with conn:
+			conn.execute("BEGIN IMMEDIATE")
+			cur = conn.execute("INSERT OR REPLACE INTO converted (key, value) VALUES (?, ?)", (key, value))
+			# rowids only grow, a replaced row gets a new one
+			conn.execute("DELETE FROM converted WHERE rowid <= ?", (cur.lastrowid - MAX_CONVERTED,))
+
+	# ---------------------------------
+	# SEARCHING
+	# ---------------------------------
+
+	def search(self, query, project_id=None, kinds=None, limit=20):
+		"""
+		Search the mirrored (and otherwise indexed) tasks, notebooks, pages and
+		comments, see `search.SearchIndex.search`
+		"""
+		return self.search_index.search(query, project_id=project_id, kinds=kinds, limit=limit)
+
+	def reindex(self):
+		"""
+		Rebuild the search index from everything in the mirror
+		"""
+		conn = self._conn()
+		with conn:
+			conn.execute("BEGIN IMMEDIATE")
+			self.search_index.clear(conn=conn)
+			for table, kind in [("tasks", "task"), ("notebooks", "notebook"), ("pages", "page")]:
+				for project_id, data in conn.execute("SELECT project_id, json FROM {}".format(table)).fetchall():
+					self.search_index.add_json(kind, project_id, [json.loads(data)], conn=conn)
+			for parent, data in conn.execute("SELECT parent, json FROM comments").fetchall():
+				self.search_index.add_json("comment", None, [json.loads(data)], parent=parent, conn=conn)
+
+	def close(self):
+		"""
+		Close this thread's connection
+		"""
+		conn = getattr(self._local, "conn", None)
+		if conn is not None:
+			conn.close()
+			self._local.conn = None
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _conn(self):
+		"""
+		Return this thread's connection, opening it if needed
+		"""
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			# isolation_level=None - transactions are managed explicitly
+			conn = sqlite3.connect(self.path, timeout=self._timeout, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			self._local.conn = conn
+		return conn
+
+	def _one(self, sql, args):
+		row = self._conn().execute(sql, args).fetchone()
+		return None if row is None else json.loads(row[0])
+
+	def _all(self, sql, args):
+		return [json.loads(row[0]) for row in self._conn().execute(sql, args)]
+
+	def _stamps(self, table, id_col, project_id):
+		"""
+		Return {id: updated_on} for all records of `table` in the project
+		"""
+		return dict(self._conn().execute(
+			"SELECT {}, updated_on FROM {} WHERE project_id = ?".format(id_col, table),
+			(project_id,)
+		))
+
+	def _fetch_comments(self, client, parents, workers):
+		"""
+		Fetch the raw comments of each api path in `parents`. Returns {parent: comments}
+		"""
+		comments, _ = client._bulk_fetch(
+			lambda parent: client._get_cmd(parent + "/comments") or [],
+			parents,
+			workers
+		)
+		return dict((p, c) for p, c in zip(parents, comments) if c is not None)
+
+	def _remove_missing(self, conn, table, id_col, project_id, ids, kind):
+		"""
+		Remove records of `table` (and their search documents) in the project
+		that are not in `ids`
+		"""
+		ids = set(ids)
+		existing = [row[0] for row in conn.execute(
+			"SELECT {} FROM {} WHERE project_id = ?".format(id_col, table), (project_id,)
+		)]
+		removed = [i for i in existing if i not in ids]
+		conn.executemany(
+			"DELETE FROM {} WHERE project_id = ? AND {} = ?".format(table, id_col),
+			[(project_id, i) for i in removed]
+		)
+		self.search_index.remove(kind, project_id, removed, conn=conn)
+		return len(removed)
+
+	def _merge(self, conn, table, where, args, model, put):
+		"""
+		Merge the fields of a locally saved `model` into its mirrored json
+		"""
+		row = conn.execute("SELECT json FROM {} WHERE {}".format(table, where), args).fetchone()
+		data = {} if row is None else json.loads(row[0])
+		data.update(model.get_fields())
+		if isinstance(model, models.Task):
+			data["task_id"] = model.task_id
+		put(conn, data)
+
+	def _put_project(self, conn, data):
+		conn.execute(
+			"INSERT OR REPLACE INTO projects (id, updated_on, json) VALUES (?, ?, ?)",
+			(data["id"], _stamp(data.get("updated_on")), json.dumps(data))
+		)
+
+	def _put_task(self, conn, project_id, data):
+		conn.execute(
+			"INSERT OR REPLACE INTO tasks (project_id, task_id, id, is_completed, updated_on, json)"
+			" VALUES (?, ?, ?, ?, ?, ?)",
+			(
+				project_id,
+				data["task_id"],
+				data.get("id"),
+				1 if data.get("is_completed") else 0,
+				_stamp(data.get("updated_on")),
+				json.dumps(data)
+			)
+		)
+		self._put_attachments(conn, "projects/{}/tasks/{}".format(project_id, data["task_id"]), data)
+		self.search_index.add_json("task", project_id, [data], conn=conn)
+
+	def _put_notebook(self, conn, project_id, data):
+		conn.execute(
+			"INSERT OR REPLACE INTO notebooks (project_id, id, updated_on, json) VALUES (?, ?, ?, ?)",
+			(project_id, data["id"], _stamp(data.get("updated_on")), json.dumps(data))
+		)
+		self.search_index.add_json("notebook", project_id, [data], conn=conn)
+
+	def _put_page(self, conn, project_id, notebook_id, data):
+		if notebook_id is None and isinstance(data.get("notebook"), dict):
+			notebook_id = data["notebook"]["id"]
+		conn.execute(
+			"INSERT OR REPLACE INTO pages (project_id, id, notebook_id, updated_on, json) VALUES (?, ?, ?, ?, ?)",
+			(project_id, data["id"], notebook_id or 0, _stamp(data.get("updated_on")), json.dumps(data))
+		)
+		self._put_attachments(conn, "projects/{}/notebook_pages/{}".format(project_id, data["id"]), data)
+		self.search_index.add_json("page", project_id, [data], parent=notebook_id, conn=conn)
+
+	def _put_comments(self, conn, parent, comments):
+		conn.execute("DELETE FROM comments WHERE parent = ?", (parent,))
+		conn.executemany(
+			"INSERT OR REPLACE INTO comments (parent, id, json) VALUES (?, ?, ?)",
+			[(parent, c["id"], json.dumps(c)) for c in comments]
+		)
+		self.search_index.remove_comments(parent, keep_ids=[c["id"] for c in comments], conn=conn)
+		self.search_index.add_json("comment", None, comments, parent=parent, conn=conn)
+
+	def _put_attachments(self, conn, parent, data):
+		if "attachments" not in data:
+			return
+		conn.execute("DELETE FROM attachments WHERE parent = ?", (parent,))
+		conn.executemany(
+			"INSERT OR REPLACE INTO attachments (parent, id, name, size, permalink, json)"
+			" VALUES (?, ?, ?, ?, ?, ?)",
+			[
+				(parent, a["id"], a.get("name"), a.get("size"), a.get("permalink"), json.dumps(a))
+				for a in data["attachments"] or []
+			]
+		)
+
+def _stamp(value):
+	"""
+	Normalize an Active Collab timestamp field (a string, or a dict with
+	`timestamp`/`mysql`/`formatted` keys) to a comparable string
+	"""
+	if value is None:
+		return None
+	if isinstance(value, dict):
+		for k in ["timestamp", "mysql", "formatted"]:
+			if k in value:
+				return unicode(value[k])
+		return json.dumps(value, sort_keys=True)
+	return unicode(value)
+
+def _walk_pages(client, subpages):
+	"""
+	Yield (page_id, updated_on) for every page in a notebook's abbreviated
+	`subpages` tree
+	"""
+	stack = list(subpages)
+	while len(stack) > 0:
+		page = stack.pop()
+		page_id = page.get("id")
+		if page_id is None:
+			page_id = client._page_id_from_permalink(page["permalink"])
+		yield page_id, _stamp(page.get("updated_on"))
+		stack.extend(page.get("subpages", []))
@@ -0,0 +1,109 @@
+import collections
+import hashlib
+import threading
+
+class HtmlConverter(object):
+	"""
+	Converts html values to markdown for display with `convert` (e.g.
+	`html2text.html2text`), memoizing the results by the sha1 of the html.
+
+	The `max_entries` most recently used results are kept in memory. If a
+	`mirror.Mirror` is given, results are also stored in it, so they are shared
+	with other shells and survive restarts.
+	"""
+
+	def __init__(self, convert, mirror=None, max_entries=1024, version=""):
+		"""
+		`version` identifies the converter's output (e.g. html2text's version),
+		results cached by a different version aren't used.
+		"""
+		self._convert = convert
+		self.mirror = mirror
+		self.max_entries = max_entries
+
+		self._lock = threading.Lock()
+		self._cache = collections.OrderedDict()
+		self._key_prefix = "{}.{}\0{}".format(
+			getattr(convert, "__module__", ""),
+			getattr(convert, "__name__", ""),
+			version
+		)
+		self._stats = {
+			"hits":			0,	# found in memory
+			"mirror_hits":	0,	# found in the mirror
+			"misses":		0,	# converted
+		}
+
+	def convert(self, html):
+		"""
+		Return the markdown for the unicode `html`
+		"""
+		key = self.cache_key(html)
+		res = self._cached(key)
+		if res is not None:
+			return res
+
+		res = None
+		if self.mirror is not None:
+			res = self.mirror.get_converted(key)
+
+		if res is not None:
+			stat = "mirror_hits"
+		else:
+			stat = "misses"
+			res = self._convert(html)
+			if self.mirror is not None:
+				self.mirror.put_converted(key, res)
+
+		with self._lock:
+			self._stats[stat] += 1
+			self._cache[key] = res
+			while len(self._cache) > self.max_entries:
+				self._cache.popitem(last=False)
+
+		return res
+
+	__call__ = convert
+
+	def iter_convert(self, values):
+		"""
+		Convert every html value in `values`, yielding the results in order as
+		each one is ready. Conversion is pure python, so it isn't spread over
+		threads, which wouldn't run it any faster.
+		"""
+		for value in values:
+			yield self.convert(value)
+
+	def cache_key(self, html):
+		"""
+		Return the cache key for the unicode `html`
+		"""
+		h = hashlib.sha1(self._key_prefix)
+		h.update("\0")
+		h.update(html.encode("utf-8"))
+		return h.hexdigest()
+
+	def stats(self):
+		"""
+		Return a copy of the cache counters
+		"""
+		with self._lock:
+			res = self._stats.copy()
+			res["entries"] = len(self._cache)
+		return res
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _cached(self, key):
+		"""
+		Return the in-memory result for `key`, or None
+		"""
+		with self._lock:
+			res = self._cache.get(key)
+			if res is not None:
+				del self._cache[key]
+				self._cache[key] = res
+				self._stats["hits"] += 1
+			return res
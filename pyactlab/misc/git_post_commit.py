@@ -1,11 +1,8 @@
 #!/usr/bin/env python
 
-import codecs
 import distutils.spawn
 import imp
-import json
 import os
-import re
 import subprocess
 import sys
 
@@ -17,6 +14,9 @@ except Exception as e:
 	print("actlab was not in $PATH, post-commit hook bailing")
 	exit()
 
+from pyactlab import daemon
+from pyactlab.sync import SyncEngine, SyncManifest
+
 def git(*args):
 	args = list(args)
 	args = ['git'] + args
@@ -39,93 +39,70 @@ def get_changed_files():
 	
 	return files
 
-client = None
-def handle_changes(fname):
+def sync_changes(fnames):
 	"""
-	Look for the $$actlab marker in the file. The marker should be on a single line
-	and should be followed by valid json
+	Push every changed file that has an $$actlab marker to active collab. The
+	marker should be on a single line and should be followed by valid json
 	"""
 	git_root = git("rev-parse", "--show-toplevel")
-	fpath = os.path.join(git_root, fname)
 
-	with codecs.open(fpath, "rb", encoding="utf-8") as f:
-		contents = f.read()
-	
-	marker = "$$actlab:"
-	match = re.match(r'.*\$\$actlab:\s*({.*})\s*', contents)
-	if match is not None:
-		try:
-			file_conf = json.loads(match.group(1))
-		except:
-			print("Could not parse actlab json config in file '{}'".format(fname))
-			return
-
-	# use this to find the config...
-	os.chdir(git_root)
-	clientShell = actlab.ActLabShell(None, load_models=False, y=True)
-	actlab_config = clientShell.config
-
-	client = actlab.pyactlab.ActLabClient(host=actlab_config.host, key=actlab_config.authkey)
-
-	if "project" not in file_conf:
-		print("no project specified, bailing")
+	config_path = actlab.find_config(git_root)
+	if config_path is None:
+		print("no actlab config found, post-commit hook bailing")
 		return
 
-	pid = file_conf["project"]
-
-	if "update" not in file_conf:
-		print("no update field specified, bailing")
+	config = actlab.Config(config_path)
+
+	# hand the files to actlabd if it's running, it pushes them in the background
+	try:
+		res = daemon.send(daemon.socket_path(config.get_root()), {
+			"cmd": "sync",
+			"root": git_root,
+			"files": fnames
+		})
+	except daemon.DaemonUnavailableError:
+		res = None
+
+	if res is not None and res["ok"]:
+		for error in res["errors"]:
+			print("error syncing '{}': {}".format(error["file"], error["error"]))
+		print("actlab: {} file(s) queued with actlabd, {} unchanged, {} failed".format(
+			len(res["queued"]),
+			len(res["skipped"]),
+			len(res["errors"])
+		))
 		return
 
-	update_field = file_conf["update"]
+	client = actlab.ActLabClient(
+		host=config.host,
+		key=config.authkey,
+		base_path=config.base_path,
+		timeout=config.request_timeout
+	)
 
-	new_value = re.sub(r'.*\$\$actlab:\s*({.*}).*', "", contents)
-	if fname.endswith(".md"):
-		new_value = clientShell._md_to_html(new_value)
+	# keep the local mirror up to date, if it exists
+	mirror = None
+	mirror_path = os.path.join(config.get_root(), ".actlab.db")
+	if os.path.exists(mirror_path):
+		mirror = actlab.Mirror(mirror_path)
 
-	if type(pid) is not int:
-		print("project type must be int, value was '{}'".format(pid))
-		return
-	
-	if "notebook" in file_conf:
-		nid = file_conf["notebook"]
-		if type(nid) is not int:
-			print("notebook type must be int, value was '{}'".format(nid))
-			return
-
-		if "page" in file_conf:
-			page_id = file_conf["page"]
-			if type(pid) is not int:
-				print("page type must be int, value was '{}'".format(page_id))
-				return
-
-			page = client.get_notebook_page(
-				project_id=pid,
-				notebook_id=nid,
-				page_id=page_id
-			)
-			page[update_field] = new_value
-			page.save()
-			print("synced '{}' with page '{}'".format(fname, page.name))
-
-		# we're just updating the notebook itself
-		else:
-			notebook = client.get_notebook(
-				project_id=pid,
-				notebook_id=nid
-			)
-			notebook[update_field] = new_value
-			notebook.save()
-			print("synced '{}' with notebook '{}'".format(fname, notebook.name))
-	
-	# we're updating the project itself
-	else:
-		project = client.get_project(project_id=pid)
-		project[update_field] = new_value
-		project.save()
-		print("synced '{}' with project '{}'".format(fname, project.name))
+	render = None
+	if actlab.load_markdown() is not None:
+		render = actlab.md_to_html
+
+	# hashes of what was last pushed, unchanged files are skipped
+	manifest = SyncManifest(os.path.join(config.get_root(), ".actlab.manifest"))
+
+	engine = SyncEngine(client, git_root, mirror=mirror, render=render, manifest=manifest)
+	synced, skipped, errors = engine.run(fnames)
+
+	for fname, kind, name in synced:
+		print("synced '{}' with {} '{}'".format(fname, kind, name))
+	for fname, msg in errors:
+		print("error syncing '{}': {}".format(fname, msg))
+	print("actlab: {} file(s) synced, {} unchanged, {} failed".format(len(synced), len(skipped), len(errors)))
+
+	client.close()
 
 if __name__ == "__main__":
-	files = get_changed_files()
-	for f in files:
-		handle_changes(f)
+	sync_changes(get_changed_files())
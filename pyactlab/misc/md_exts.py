@@ -3,6 +3,36 @@ import re
 from markdown.extensions import Extension
 from markdown.treeprocessors import Treeprocessor
 
+# whitespace at the start of a line that isn't a space. Leading whitespace is
+# shown as spaces, elsewhere these characters are left as they are
+_LEADING_WS_RE = re.compile(r'^[ \r\f\v]+', re.M)
+
+def _leading_spaces(match):
+	return " " * len(match.group(0))
+
+def escape_code(text):
+	"""
+	Escape the text of a code block as html that keeps its whitespace: tabs
+	are expanded to four spaces, leading whitespace becomes spaces, spaces
+	become `&nbsp;` and newlines `<br/>`.
+
+	The text is only scanned line by line if it has carriage returns, form
+	feeds or vertical tabs, everything else is done with whole-text replaces.
+	"""
+	text = text.replace("\t", "    ")
+	if "\r" in text or "\f" in text or "\v" in text:
+		text = _LEADING_WS_RE.sub(_leading_spaces, text)
+
+	return (text.
+		replace("&", "&amp;").
+		replace('"', "&quot;").
+		replace(" ", "&nbsp;").
+		replace("<", "&lt;").
+		replace(">", "&gt;").
+		replace("\r\n", "<br/>").
+		replace("\n", "<br/>")
+	)
+
 class ActLabTreeProcessor(Treeprocessor):
 	"""
 	Highlight the source code
@@ -16,7 +46,6 @@ class ActLabTreeProcessor(Treeprocessor):
 			children = block.getchildren()
 			if len(children) == 1 and children[0].tag == 'code':
 				text = children[0].text
-				lines = text.split("\n")
 				#<div class=\"syntax_higlighted source-code\">
 				#    <div class=\"syntax_higlighted_line_numbers lines\">
 				#        <pre>1\n2\n3\n4<\/pre>
@@ -42,25 +71,7 @@ class ActLabTreeProcessor(Treeprocessor):
 					# '</div>'
 				# ])
 
-				converted_lines = []
-				for line in lines:
-					line = line.replace("\t", "    ")
-					match = re.match(r'^(\s+)', line)
-					if match:
-						l = len(match.group(1))
-						line = (" " * l) + line[l:]
-					converted_lines.append(line)
-				text = "\n".join(converted_lines)
-
-				text = (text.
-					replace("&", "&amp;").
-					replace('"', "&quot;").
-					replace(" ", "&nbsp;").
-					replace("<", "&lt;").
-					replace(">", "&gt;").
-					replace("\r\n", "<br/>").
-					replace("\n", "<br/>")
-				)
+				text = escape_code(text)
 
 				html = "<blockquote style='font-family:monospace'><p>" + text + "</p></blockquote>"
 				
@@ -0,0 +1,217 @@
+import codecs
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+import markdown
+
+from md_exts import ActLabCode
+
+# bump this whenever a change to the extensions changes the html they produce,
+# so stale cached renders aren't used
+RENDER_VERSION = 1
+
+DEFAULT_EXTENSIONS = ["tables", "footnotes", "toc", ActLabCode]
+
+# the disk cache is pruned on the first write to it and after every this many
+# writes after that
+PRUNE_EVERY = 100
+
+def default_cache_dir():
+	"""
+	Return the directory rendered html is cached in by default
+	"""
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "pyactlab", "render")
+
+class MarkdownRenderer(object):
+	"""
+	Converts markdown to html, reusing one `markdown.Markdown` pipeline per
+	thread (reset between documents) instead of building a new one for every
+	conversion.
+
+	Rendered html is cached by the sha1 of the markdown source and the
+	extension config, in memory (the `max_entries` most recently used) and,
+	if `cache_dir` isn't None, on disk. Rendering unchanged markdown again
+	only costs a hash and a lookup. The disk cache is regularly pruned back to
+	the `max_disk_entries` most recently used renders (see PRUNE_EVERY), by
+	modification time.
+	"""
+
+	def __init__(self, extensions=None, cache_dir=None, max_entries=256, max_disk_entries=2000):
+		"""
+		`extensions` are extension names or Extension classes, classes are
+		instantiated for each thread's pipeline. Defaults to DEFAULT_EXTENSIONS.
+		"""
+		if extensions is None:
+			extensions = DEFAULT_EXTENSIONS
+
+		self.extensions = list(extensions)
+		self.cache_dir = cache_dir
+		self.max_entries = max_entries
+		self.max_disk_entries = max_disk_entries
+		self._disk_writes = 0
+
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self._cache = collections.OrderedDict()
+		self._config_key = "\0".join([
+			str(RENDER_VERSION),
+			markdown.version,
+		] + [_extension_name(e) for e in self.extensions])
+		self._stats = {
+			"hits":			0,	# found in memory
+			"disk_hits":	0,	# found on disk
+			"misses":		0,	# rendered
+		}
+
+	def render(self, md):
+		"""
+		Return the html for the markdown `md`
+		"""
+		if isinstance(md, str):
+			md = md.decode("utf-8")
+
+		key = self.cache_key(md)
+
+		with self._lock:
+			html = self._cache.get(key)
+			if html is not None:
+				del self._cache[key]
+				self._cache[key] = html
+				self._stats["hits"] += 1
+				return html
+
+		html = self._read_disk(key)
+		if html is not None:
+			stat = "disk_hits"
+		else:
+			stat = "misses"
+			html = self._convert(md)
+			self._write_disk(key, html)
+
+		with self._lock:
+			self._stats[stat] += 1
+			self._cache[key] = html
+			while len(self._cache) > self.max_entries:
+				self._cache.popitem(last=False)
+
+		return html
+
+	__call__ = render
+
+	def cache_key(self, md):
+		"""
+		Return the cache key for the unicode markdown `md`
+		"""
+		h = hashlib.sha1(self._config_key)
+		h.update("\0")
+		h.update(md.encode("utf-8"))
+		return h.hexdigest()
+
+	def stats(self):
+		"""
+		Return a copy of the cache counters
+		"""
+		with self._lock:
+			res = self._stats.copy()
+			res["entries"] = len(self._cache)
+		return res
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _convert(self, md):
+		"""
+		Render `md` with this thread's pipeline
+		"""
+		converter = getattr(self._local, "converter", None)
+		if converter is None:
+			extensions = [e() if isinstance(e, type) else e for e in self.extensions]
+			converter = markdown.Markdown(extensions=extensions)
+			self._local.converter = converter
+		else:
+			converter.reset()
+		return converter.convert(md)
+
+	def _disk_path(self, key):
+		return os.path.join(self.cache_dir, key[:2], key + ".html")
+
+	def _read_disk(self, key):
+		if self.cache_dir is None:
+			return None
+		path = self._disk_path(key)
+		try:
+			with codecs.open(path, "rb", encoding="utf-8") as f:
+				html = f.read()
+			# mark it as recently used, so it's pruned last
+			os.utime(path, None)
+			return html
+		except (IOError, OSError):
+			return None
+
+	def _write_disk(self, key, html):
+		"""
+		Cache `html` on disk. A failure to write it only means it's rendered again
+		"""
+		if self.cache_dir is None:
+			return
+		path = self._disk_path(key)
+		directory = os.path.dirname(path)
+		try:
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			fd, tmp_path = tempfile.mkstemp(prefix=".render.", dir=directory)
+		except (IOError, OSError):
+			return
+
+		try:
+			with os.fdopen(fd, "wb") as f:
+				f.write(html.encode("utf-8"))
+			os.rename(tmp_path, path)
+		except (IOError, OSError):
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+
+		with self._lock:
+			prune = (self._disk_writes % PRUNE_EVERY == 0)
+			self._disk_writes += 1
+		if prune:
+			self._prune_disk()
+
+	def _prune_disk(self):
+		"""
+		Remove the least recently used renders on disk until at most
+		`max_disk_entries` are left. Other processes may be pruning too, files
+		that are already gone are skipped.
+		"""
+		entries = []
+		for directory, _, names in os.walk(self.cache_dir):
+			for name in names:
+				if not name.endswith(".html"):
+					continue
+				path = os.path.join(directory, name)
+				try:
+					entries.append((os.path.getmtime(path), path))
+				except OSError:
+					continue
+
+		if len(entries) <= self.max_disk_entries:
+			return
+
+		entries.sort()
+		for _, path in entries[:len(entries) - self.max_disk_entries]:
+			try:
+				os.remove(path)
+			except OSError:
+				continue
+
+def _extension_name(extension):
+	if isinstance(extension, basestring):
+		return extension
+	if not isinstance(extension, type):
+		extension = extension.__class__
+	return extension.__name__
@@ -1,10 +1,80 @@
 import json
+import os
+
+def _to_utf8(value):
+	return unicode(value).encode("utf-8")
+
+class ModelMeta(type):
+	"""
+	Compiles each model class's `fields` dict once, when the class is defined,
+	into the casts used to decode api json. Fields and `instance_attrs` are
+	stored in `__slots__` instead of per-instance dicts.
+	"""
+
+	def __new__(mcs, name, bases, ns):
+		fields = ns.get("fields")
+		if fields is None:
+			fields = getattr(bases[0], "fields", {})
+
+		# don't require the user to define this, hardcode it in
+		fields = dict(fields)
+		fields.setdefault("id", int)
+
+		inherited = set()
+		defaults = {}
+		for base in reversed(bases):
+			inherited.update(getattr(base, "_slotted", ()))
+			defaults.update(getattr(base, "_defaults", {}))
+
+		# instance attribute defaults can't stay class attributes once they are
+		# slots, they are returned by __getattr__ until first set instead
+		for attr in ns.get("instance_attrs", ()):
+			if attr in ns:
+				defaults[attr] = ns.pop(attr)
+			else:
+				defaults.setdefault(attr, None)
+
+		casts = []
+		field_defaults = []
+		for field, v in fields.iteritems():
+			if type(v) is type:
+				# do NOT instantiate this at this moment, leave the values
+				# as None
+				cls = v
+			else:
+				cls = v.__class__
+				field_defaults.append((field, v))
+			casts.append((field, _to_utf8 if cls is unicode else cls))
+			defaults.setdefault(field, None)
+
+		slots = list(ns.get("__slots__", ()))
+		for attr in list(fields) + list(ns.get("instance_attrs", ())):
+			if attr not in inherited and attr not in slots:
+				slots.append(attr)
+		ns["__slots__"] = tuple(slots)
+
+		cls = type.__new__(mcs, name, bases, ns)
+		cls._casts = tuple(casts)
+		cls._cast_map = dict(casts)
+		cls._field_defaults = tuple(field_defaults)
+		cls._field_names = tuple(fields)
+		cls._field_set = frozenset(fields)
+		cls._defaults = defaults
+		cls._slotted = frozenset(inherited.union(slots))
+
+		if cls.accept_all_fields:
+			cls.__setattr__ = cls._setattr_with_extra
+
+		return cls
 
 class Model(object):
 	"""
 	Base class for all PyActLab models
 	"""
 
+	__metaclass__ = ModelMeta
+	__slots__ = ("_client", "_extra", "__dict__")
+
 	# ---------------------------------
 	# STATIC
 	# ---------------------------------
@@ -16,6 +86,30 @@ class Model(object):
 		"""
 		res = cls(client, fields, **kwargs)
 		return res
+
+	@classmethod
+	def create_lazy(cls, client, fields, **kwargs):
+		"""
+		Create a lightweight Model that keeps the raw `fields` json and only
+		decodes each field the first time it is read. Attachments are not
+		created until `attachments` is first accessed.
+		"""
+		if cls.accept_all_fields:
+			return cls.create(client, fields, **kwargs)
+
+		res = cls.__new__(cls)
+		res._client = client
+		res._raw = fields
+
+		for k,v in kwargs.iteritems():
+			if hasattr(res, k):
+				setattr(res, k, v)
+
+		if "attachments" in fields:
+			res._raw_attachments = fields["attachments"]
+		res._add_std_fields(fields)
+		res._check_fetched(fields)
+		return res
 	
 	# ---------------------------------
 	# PUBLIC
@@ -25,16 +119,29 @@ class Model(object):
 	id_field = "id"
 
 	fields = {}
-	__fields = None
-	__field_types = None
 	sub_models = {}
 	needs_project_id = True
-	attachments = []
 	accept_all_fields = False
 
+	# fields that may be missing from abbreviated json (e.g. pages in a
+	# notebook's subpages), the full model is fetched the first time one is read
+	fetch_on_access = ()
+
+	# instance attribute name -> name of the method that builds it the first
+	# time it is read
+	lazy_attrs = {}
+
+	# per-instance attributes that aren't api fields, stored in slots
+	instance_attrs = ("creator", "created_on", "attachments", "_raw", "_raw_attachments", "_comments", "_fetched")
+	attachments = []
 	creator =		None # id of the creator
 	created_on =	None # formatted date/time
 
+	_raw =				None # json of a lazy model that hasn't been decoded yet
+	_raw_attachments =	None # attachment json, Attachments are created on first access
+	_comments =			None # memoized result of get_comments
+	_fetched =			False # True once the model holds all fetch_on_access fields
+
 	def __init__(self, client, fields=None, **extra):
 		"""
 		Create a new model
@@ -52,7 +159,13 @@ class Model(object):
 		"""
 		Return a copy of this model's fields dict
 		"""
-		return self.__fields.copy()
+		if self._raw is not None:
+			self._hydrate()
+
+		res = dict((name, getattr(self, name)) for name in self._field_names)
+		if self._extra is not None:
+			res.update(self._extra)
+		return res
 	
 	def save(self, **with_extra):
 		"""
@@ -76,10 +189,12 @@ class Model(object):
 			print("({cls}): self.project_id is None, can't refresh".format(cls=self.__class__.__name__))
 			return
 
+		# tasks are fetched by their task_id, not their id
+		model_id = getattr(self, self.id_field)
 		if self.needs_project_id:
-			args = [self.project_id, self.id]
+			args = [self.project_id, model_id]
 		else:
-			args = [self.id]
+			args = [model_id]
 
 		res = getattr(self._client, "get_" + self.method)(*args, raw=True)
 		self._create_fields(res)
@@ -93,37 +208,49 @@ class Model(object):
 	
 	def comment(self, msg):
 		"""
-		Comment on the current model
+		Comment on the current model, returning the new Comment
 		"""
-		self._client.add_comment(self, msg)
+		res = self._client.add_comment(self, msg)
+		self._comments = None
+		return res
 	
-	def get_comments(self):
+	def get_comments(self, refresh=False):
 		"""
-		Return a list of comments attached to this model
+		Return a list of comments attached to this model. The list is fetched
+		once and memoized, pass `refresh=True` to fetch it again.
 		"""
-		return self._client.get_comments(self)
+		if refresh or self._comments is None:
+			self._comments = self._client.get_comments(self)
+		return self._comments
+
+	@property
+	def comments(self):
+		return self.get_comments()
 	
 	def attach(self, filename, file_contents, **extra):
 		"""
-		Add an attachment to the model
+		Add an attachment to the model. `file_contents` may also be a file object
 		"""
 		self._client.add_attachment(self, filename, file_contents, **extra)
-	
-	# ---------------------------------
-	# PRIVATE
-	# ---------------------------------
 
-	def _get_class(self, item):
+	def attach_many(self, files, **kwargs):
 		"""
-		Return the class of the item. If the item is a class already,
-		return the item
+		Add many attachments to the model, packing them into as few requests as
+		possible. See `ActLabClient.add_attachments`
 		"""
-		# it's already a class, return it
-		if type(item) == type:
-			return item
+		return self._client.add_attachments(self, files, **kwargs)
 
-		# get the class
-		return item.__class__
+	def attach_file(self, path, progress=None, **extra):
+		"""
+		Add the file at `path` as an attachment to the model, streaming it
+		from disk
+		"""
+		with open(path, "rb") as f:
+			self._client.add_attachment(self, os.path.basename(path), f, progress=progress, **extra)
+	
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
 
 	def _add_std_fields(self, json):
 		"""
@@ -141,61 +268,89 @@ class Model(object):
 
 	def _create_fields(self, init=None):
 		"""
-		Instantiate (or make copies of the defaults) of each field defined
-		in this model's fields dict, casting values where appropriate
+		Set each field defined in this model's fields dict from `init`, casting
+		values with the class's compiled casts. None values never overwrite a
+		field that is already set.
 		"""
-		# don't require the user to define this, hardcode it in
-		if "id" not in self.fields:
-			self.fields["id"] = int
-
-		if self.__fields is None:
-			self.__fields = {}
-		if self.__field_types is None:
-			self.__field_types = self.fields.copy()
-
-		for k,v in self.fields.iteritems():
-			if type(v) is type:
-				# do NOT instantiate this at this moment, leave the values
-				# as None
-				v = None
-			else:
-				self.__field_types[k] = v.__class__
+		if init is None:
+			init = {}
 
-			if init is not None and k in init:
-				cls = self._get_class(self.__field_types[k])
+		# decode what's left of a lazy model first so that none of it is lost
+		if self._raw is not None:
+			self._hydrate()
 
-				# make sure it's the appropriate type
-				# also don't try to cast it to something if it is None
-				if init[k] is not None:
-					if cls is unicode:
-						v = cls(init[k]).encode("utf-8")
-					else:
-						v = cls(init[k])
-				else:
-					v = None
+		# fields are always slots, skip any __setattr__ override
+		set_field = object.__setattr__
 
-                        if k in self.__fields and self.__fields[k] is not None and v is None:
-                            continue
+		for k, cast in self._casts:
+			v = init.get(k)
+			if v is not None:
+				set_field(self, k, cast(v))
 
-			self.__fields[k] = v
+		for k, default in self._field_defaults:
+			if k not in init:
+				set_field(self, k, default)
 
-		# add any non-defined fields to self.__fields
+		# add any non-defined fields to self._extra
 		if init and self.accept_all_fields:
+			if self._extra is None:
+				set_field(self, "_extra", {})
 			for k,v in init.iteritems():
-				if k not in self.__fields:
-					self.__fields[k] = v
+				if k not in self._field_set and k not in self._extra:
+					self._extra[k] = v
 
-		if init is not None and "attachments" in init:
-			self._create_attachments(init["attachments"])
+		if "attachments" in init:
+			# created on first access, see __getattr__
+			self._raw_attachments = init["attachments"]
+			if self._is_set("attachments"):
+				object.__delattr__(self, "attachments")
 
 		if init:
 			self._add_std_fields(init)
+			self._check_fetched(init)
 
 	def _create_attachments(self, json):
 		self.attachments = []
 		for a in json:
 			attachment = Attachment.create(self._client, a)
 			self.attachments.append(attachment)
+
+	def _check_fetched(self, json):
+		"""
+		Mark the model as fetched if `json` has all of the `fetch_on_access` fields
+		"""
+		if self.fetch_on_access and not self._fetched:
+			for k in self.fetch_on_access:
+				if k not in json:
+					return
+			self._fetched = True
+
+	def _hydrate(self):
+		"""
+		Decode every field of a lazy model that hasn't been read or set yet
+		"""
+		raw = self._raw
+		self._raw = None
+
+		set_field = object.__setattr__
+		for k, cast in self._casts:
+			v = raw.get(k)
+			if v is not None and not self._is_set(k):
+				set_field(self, k, cast(v))
+
+		for k, default in self._field_defaults:
+			if k not in raw and not self._is_set(k):
+				set_field(self, k, default)
+
+	def _is_set(self, k):
+		"""
+		Return True if the slot `k` holds a value (without falling back to __getattr__)
+		"""
+		try:
+			object.__getattribute__(self, k)
+			return True
+		except AttributeError:
+			return False
 	
 	def __getitem__(self, k):
 		"""
@@ -211,22 +366,61 @@ class Model(object):
 
 	def __getattr__(self, k):
 		"""
-		Allow users to access model members directly via dot notation
-		"""
-		if self.__fields is not None and k in self.__fields:
-			return self.__fields[k]
-		else:
-			return object.__getattribute__(self, k)
-
-	def __setattr__(self, k, v):
-		"""
-		Allow users to set model members directly via dot notation
-		"""
-		if self.__fields is not None and k in self.__fields:
-			self.__fields[k] = v
-			return v
+		Only called for attributes that haven't been set: decode the field from
+		the raw json of a lazy model, build a lazy attribute, fetch the full model
+		for a `fetch_on_access` field, or return the field or instance attribute's
+		default, or an extra field (see `accept_all_fields`)
+		"""
+		defaults = self._defaults
+		if k[0] == "_":
+			if k in defaults:
+				return defaults[k]
+			if k == "_extra":
+				return None
+			raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, k))
+
+		raw = self._raw
+		if raw is not None and k in self._field_set:
+			v = raw.get(k)
+			if v is not None:
+				v = self._cast_map[k](v)
+				object.__setattr__(self, k, v)
+				return v
+
+		if k == "attachments" and self._raw_attachments is not None:
+			raw_attachments = self._raw_attachments
+			self._raw_attachments = None
+			self._create_attachments(raw_attachments)
+			return self.attachments
+
+		if k in self.lazy_attrs:
+			res = getattr(self, self.lazy_attrs[k])()
+			if res is not None:
+				return res
+
+		if k in self.fetch_on_access and not self._fetched and self.id is not None:
+			# only try once, refresh() leaves the field unset if it's empty
+			self._fetched = True
+			self.refresh()
+			return getattr(self, k)
+
+		if k in defaults:
+			return defaults[k]
+
+		if self._extra is not None and k in self._extra:
+			return self._extra[k]
+
+		raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, k))
+
+	def _setattr_with_extra(self, k, v):
+		"""
+		__setattr__ for models that accept all fields, so extra fields can be
+		set via dot notation too
+		"""
+		if k not in self._slotted and self._extra is not None and k in self._extra:
+			self._extra[k] = v
 		else:
-			return object.__setattr__(self, k, v)
+			object.__setattr__(self, k, v)
 
 
 # ---------------------------------
@@ -286,8 +480,12 @@ class Notebook(Model):
 		"visibility":		int,	# (integer) - Object visibility. 0 marks private visibility and 1 is for normal visibility.
 		"milestone_id":		int		# (integer) - The ID of the parent Milestone.
 	}
+	lazy_attrs = {"subpages": "_create_subpages", "tree": "_create_tree"}
+	instance_attrs = ("subpages", "project_id", "tree", "_raw_subpages")
 	subpages = []
 	project_id = None
+	tree = None # tree.NotebookTree of all pages, built on first access
+	_raw_subpages = None # abbreviated page json, Pages are created on first access
 
 	def save(self, **with_extra):
 		# will fail if it's a brand new model
@@ -297,6 +495,19 @@ class Notebook(Model):
 			new_fields = res.get_fields()
 			self._create_fields(init=new_fields)
 
+	def _create_subpages(self):
+		self.subpages = self.tree.roots
+		return self.subpages
+
+	def _create_tree(self):
+		# avoid a circular import, tree imports this module
+		from tree import NotebookTree
+
+		raw_subpages = self._raw_subpages or []
+		self._raw_subpages = None
+		self.tree = NotebookTree(self._client, self.project_id, self.id, raw_subpages)
+		return self.tree
+
 class Page(Model):
 	method = "notebook_page"
 	fields = {
@@ -306,9 +517,14 @@ class Page(Model):
 
 		"parent_type":	unicode	# not saveable, but is contained within the page json
 	}
+	# pages in a notebook's subpages don't have a body
+	fetch_on_access = ("body",)
+	lazy_attrs = {"subpages": "_create_subpages"}
+	instance_attrs = ("subpages", "project_id", "notebook_id", "_raw_subpages")
 	subpages = []
 	project_id = None
 	notebook_id = None # needed for saving the notebook page
+	_raw_subpages = None # abbreviated page json, Pages are created on first access
 
 	def save(self, **with_extra):
 		# will fail if it's a brand new model
@@ -318,6 +534,20 @@ class Page(Model):
 			new_fields = res.get_fields()
 			self._create_fields(init=new_fields)
 
+	def _create_subpages(self):
+		if self._raw_subpages is None:
+			return None
+		raw_subpages = self._raw_subpages
+		self._raw_subpages = None
+
+		subpages = []
+		for p in raw_subpages:
+			page = self._client._create_page(self.project_id, self.notebook_id, p)
+			page.parent_id = self.id
+			subpages.append(page)
+		self.subpages = subpages
+		return subpages
+
 class Task(Model):
 	id_field = "task_id"
 	method = "task"
@@ -338,6 +568,7 @@ class Task(Model):
 		"created_by_email":	unicode	# (string) - Used for anonymous users.
 	}
 
+	instance_attrs = ("project_id", "task_id")
 	project_id = None
 
 	# the task id of the task - NOT THE SAME AS ITS ID!!!!
@@ -350,6 +581,8 @@ class Task(Model):
 			res = self._client.new_task(self.project_id, **fields)
 			new_fields = res.get_fields()
 			self._create_fields(init=new_fields)
+			# not an editable field, so it isn't in get_fields()
+			self.task_id = res.task_id
 
 # TODO subtasks
 # body (text) - The Subtask name is required field when creating a new Subtask.
@@ -373,6 +606,19 @@ class Attachment(Model):
 
 	def download(self):
 		return self._client.download_attachment(self.permalink)
+
+	def download_to(self, dest, progress=None, **kwargs):
+		"""
+		Stream the attachment into `dest` (a path or file object), verifying its
+		size. See `ActLabClient.download_attachment_to`
+		"""
+		return self._client.download_attachment_to(
+			self.permalink,
+			dest,
+			size=self.size,
+			progress=progress,
+			**kwargs
+		)
 	
 class Comment(Model):
 	method = "comment"
@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import uuid
+
+class MultipartEncoder(object):
+	"""
+	A read-only, file-like multipart/form-data body. Field values and small
+	in-memory files are held as-is, file objects are read `chunk_size` bytes
+	at a time as the body is sent, so uploading a file never holds more than a
+	chunk of it in memory.
+
+	`requests` streams any body with a `read` method, and uses `len` for the
+	Content-Length header.
+	"""
+
+	def __init__(self, fields, files, boundary=None, chunk_size=64 * 1024, progress=None):
+		"""
+		`fields` maps form field names to values (lists are sent as repeated fields).
+		`files` maps form field names to `(filename, data)` tuples, where `data` is a
+		byte string, a unicode string or a file object open in binary mode.
+
+		`progress`, if given, is called as `progress(bytes_sent, total_bytes)`
+		each time a chunk of the body is read.
+		"""
+		if boundary is None:
+			boundary = uuid.uuid4().hex
+
+		self.boundary = boundary
+		self.content_type = "multipart/form-data; boundary=" + boundary
+		self._chunk_size = chunk_size
+		self._progress = progress
+
+		# list of [data, length] where data is a byte string or a file object
+		self._parts = []
+		for name, value in fields.iteritems():
+			values = value if isinstance(value, (list, tuple)) else [value]
+			for v in values:
+				self._add_bytes(self._part_header(name))
+				self._add_bytes(_to_bytes(v))
+				self._add_bytes("\r\n")
+
+		for name, (filename, data) in files.iteritems():
+			self._add_bytes(self._part_header(name, filename))
+			if hasattr(data, "read"):
+				self._parts.append([data, remaining_size(data)])
+			else:
+				self._add_bytes(_to_bytes(data))
+			self._add_bytes("\r\n")
+
+		self._add_bytes("--{}--\r\n".format(boundary))
+
+		self.len = sum(length for data, length in self._parts)
+		self._sent = 0
+		self._idx = 0
+		self._offset = 0
+
+	def __len__(self):
+		return self.len
+
+	def read(self, size=-1):
+		"""
+		Read up to `size` bytes of the encoded body (all remaining bytes if `size`
+		is negative)
+		"""
+		if size is None or size < 0:
+			size = self.len - self._sent
+
+		chunks = []
+		needed = size
+		while needed > 0 and self._idx < len(self._parts):
+			data, length = self._parts[self._idx]
+			count = min(needed, length - self._offset, self._chunk_size)
+
+			if isinstance(data, str):
+				chunk = data[self._offset:self._offset + count]
+			else:
+				chunk = data.read(count)
+				if len(chunk) != count:
+					raise IOError("File changed size while it was being uploaded")
+
+			chunks.append(chunk)
+			needed -= count
+			self._offset += count
+			if self._offset == length:
+				self._idx += 1
+				self._offset = 0
+
+		res = "".join(chunks)
+		self._sent += len(res)
+		if self._progress is not None and len(res) > 0:
+			self._progress(self._sent, self.len)
+		return res
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _add_bytes(self, data):
+		self._parts.append([data, len(data)])
+
+	def _part_header(self, name, filename=None):
+		"""
+		Return the boundary and headers that start the part for field `name`
+		"""
+		disposition = 'form-data; name="{}"'.format(_quote(name))
+		lines = ["--" + self.boundary]
+		if filename is None:
+			lines.append("Content-Disposition: " + disposition)
+		else:
+			content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+			lines.append("Content-Disposition: {}; filename=\"{}\"".format(disposition, _quote(filename)))
+			lines.append("Content-Type: " + content_type)
+		return "\r\n".join(lines) + "\r\n\r\n"
+
+def _to_bytes(value):
+	if isinstance(value, unicode):
+		return value.encode("utf-8")
+	if isinstance(value, str):
+		return value
+	return str(value)
+
+def _quote(value):
+	return _to_bytes(value).replace("\\", "\\\\").replace('"', '\\"')
+
+def remaining_size(f):
+	"""
+	Return the number of bytes left to be read from the file object `f`
+	"""
+	pos = f.tell()
+	if hasattr(f, "fileno"):
+		try:
+			return os.fstat(f.fileno()).st_size - pos
+		except (AttributeError, IOError, OSError, ValueError):
+			pass
+
+	f.seek(0, os.SEEK_END)
+	size = f.tell() - pos
+	f.seek(pos)
+	return size
@@ -0,0 +1,163 @@
+import threading
+import time
+
+from workers import TimeoutError, WorkerPool
+
+class Prefetcher(object):
+	"""
+	Loads things in the background before they are asked for. Each load is
+	submitted under a key; asking for that key later takes the result, waiting
+	for it if the load is still in flight, instead of loading it again.
+
+	Results that finished more than `max_age` seconds ago aren't used, nor are
+	loads still in flight after waiting `timeout` seconds for them. Loads are
+	run on a pool of at most `workers` threads that is started the first time
+	something is submitted.
+	"""
+
+	def __init__(self, workers=4, max_age=300, timeout=30, name="pyactlab-prefetch"):
+		"""
+		"""
+		self.workers = workers
+		self.max_age = max_age
+		self.timeout = timeout
+		self._name = name
+
+		self._pool = None
+		self._lock = threading.Lock()
+		# key -> (generation, Future)
+		self._futures = {}
+		# key -> time the load finished
+		self._finished = {}
+		self._generation = 0
+		self._stats = {
+			"submitted":	0,
+			"used":			0,	# results (or in-flight loads) that were taken
+			"waited":		0,	# of those, how many were still in flight
+			"unused":		0,	# failed, too old, timed out, discarded or cancelled
+		}
+
+	def submit(self, key, fn, *args, **kwargs):
+		"""
+		Start loading `key` with `fn(*args, **kwargs)` in the background, unless it
+		is already being loaded. Returns the load's Future.
+		"""
+		with self._lock:
+			if key in self._futures:
+				return self._futures[key][1]
+
+			if self._pool is None:
+				self._pool = WorkerPool(self.workers, name=self._name)
+
+			generation = self._generation
+			future = self._pool.submit(self._run, key, generation, fn, args, kwargs)
+			self._futures[key] = (generation, future)
+			self._stats["submitted"] += 1
+		return future
+
+	def get(self, key, load):
+		"""
+		Return the prefetched result for `key`, waiting up to `timeout` seconds
+		for it if it is still being loaded. If `key` wasn't prefetched, or its
+		load failed, is too old or took too long, `load()` is called instead.
+		"""
+		with self._lock:
+			entry = self._futures.pop(key, None)
+			finished = self._finished.pop(key, None)
+
+		if entry is None:
+			return load()
+		future = entry[1]
+
+		if finished is not None and time.time() - finished > self.max_age:
+			self._count("unused")
+			return load()
+
+		in_flight = not future.done()
+		try:
+			exception = future.exception(self.timeout)
+		except TimeoutError:
+			# the load may be stuck, its result won't be used
+			self._count("unused")
+			return load()
+
+		if exception is not None or future.result() is self._cancelled:
+			self._count("unused")
+			return load()
+
+		self._count("used")
+		if in_flight:
+			self._count("waited")
+		return future.result()
+
+	def discard(self, key):
+		"""
+		Forget the prefetched result for `key` (e.g. when the thing it loaded was
+		changed locally). If it is still being loaded, its result isn't used.
+		"""
+		with self._lock:
+			entry = self._futures.pop(key, None)
+			self._finished.pop(key, None)
+			if entry is not None:
+				self._stats["unused"] += 1
+
+	def cancel(self):
+		"""
+		Forget every prefetched result and skip the loads that haven't started yet
+		(e.g. when switching to another project). Loads already running finish,
+		but their results aren't used.
+		"""
+		with self._lock:
+			self._generation += 1
+			self._stats["unused"] += len(self._futures)
+			self._futures.clear()
+			self._finished.clear()
+
+	def pending(self):
+		"""
+		Return the number of loads that haven't finished yet
+		"""
+		with self._lock:
+			return len([f for g, f in self._futures.values() if not f.done()])
+
+	def shutdown(self, wait=False, timeout=None):
+		"""
+		Cancel everything and stop the pool, see `WorkerPool.shutdown`
+		"""
+		self.cancel()
+		with self._lock:
+			pool = self._pool
+			self._pool = None
+		if pool is not None:
+			pool.shutdown(wait=wait, timeout=timeout)
+
+	def stats(self):
+		"""
+		Return a copy of the counters
+		"""
+		with self._lock:
+			return self._stats.copy()
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	_cancelled = object()
+
+	def _run(self, key, generation, fn, args, kwargs):
+		"""
+		Run a load unless it was cancelled while it was queued
+		"""
+		if generation != self._generation:
+			return self._cancelled
+
+		res = fn(*args, **kwargs)
+		with self._lock:
+			entry = self._futures.get(key)
+			if entry is not None and entry[0] == generation:
+				self._finished[key] = time.time()
+		return res
+
+	def _count(self, stat):
+		with self._lock:
+			self._stats[stat] += 1
@@ -0,0 +1,443 @@
+import array
+import HTMLParser
+import os
+import re
+import sqlite3
+import threading
+
+from tree import page_id_from_permalink
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACE_RE = re.compile(r'\s+', re.UNICODE)
+_PROJECT_RE = re.compile(r'^projects/(\d+)(?:/|$)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_docs (
+	doc_id		INTEGER PRIMARY KEY,
+	kind		TEXT NOT NULL,
+	project_id	INTEGER NOT NULL,
+	model_id	INTEGER NOT NULL,
+	parent		TEXT,
+	UNIQUE (kind, project_id, model_id)
+);
+CREATE INDEX IF NOT EXISTS search_docs_parent ON search_docs (parent);
+"""
+
+# the full-text table shares its rowids with search_docs
+FTS_SCHEMA = {
+	"fts5": "CREATE VIRTUAL TABLE search_fts USING fts5(name, body, tokenize='porter unicode61')",
+	"fts4": "CREATE VIRTUAL TABLE search_fts USING fts4(name, body, tokenize=porter)",
+}
+
+# matches in a name count this many times more than matches in a body
+NAME_WEIGHT = 10.0
+
+# ranking is what makes searching slow, only this many of the most recently
+# indexed documents that match are ranked, older ones are returned unranked
+RANK_WINDOW = 5000
+
+SNIPPET_START = "["
+SNIPPET_END = "]"
+
+class SearchHit(object):
+	"""
+	A model found by SearchIndex.search
+	"""
+
+	__slots__ = ("kind", "project_id", "id", "parent", "name", "snippet", "score")
+
+	def __init__(self, kind, project_id, id, parent, name, snippet, score):
+		"""
+		"""
+		self.kind = kind
+		self.project_id = project_id
+		self.id = id
+		self.parent = parent
+		self.name = name
+		self.snippet = snippet
+		self.score = score
+
+	def __repr__(self):
+		return "<SearchHit {} {}:{} {!r}>".format(self.kind, self.project_id, self.id, self.name)
+
+class SearchIndex(object):
+	"""
+	Full-text index of task, notebook and page names and bodies and of comment
+	bodies, kept in SQLite (FTS5, or FTS4 if the sqlite library doesn't have
+	FTS5). Html bodies are indexed as plain text.
+
+	Each document is identified by its kind (task, notebook, page or comment),
+	its project and the id used to select it (the task_id of tasks). `parent`
+	is the notebook id of pages and the api path of the model comments are on
+	(e.g. `projects/3/tasks/5`).
+
+	The index either lives in its own database at `path`, or shares the
+	connections of another database through `connect` (e.g. the Mirror's, so
+	it is updated in the same transactions). Each thread gets its own
+	connection.
+	"""
+
+	def __init__(self, path=None, connect=None, timeout=30.0):
+		"""
+		`connect` is a function returning the calling thread's connection
+		"""
+		if connect is None:
+			if path is None:
+				raise ValueError("A path or a connect function must be given")
+			self.path = os.path.abspath(os.path.expanduser(path))
+			self._timeout = timeout
+			self._local = threading.local()
+			connect = self._own_conn
+		else:
+			self.path = None
+		self._connect = connect
+
+		conn = self._connect()
+		conn.executescript(SCHEMA)
+		self.fts, self.created = _create_fts(conn)
+
+	def __len__(self):
+		return self._connect().execute("SELECT COUNT(*) FROM search_docs").fetchone()[0]
+
+	def add(self, kind, project_id, id, name, body, parent=None, conn=None):
+		"""
+		Add (or update) the document of a model. `body` is plain text, if it is
+		None the body that was already indexed is kept.
+		"""
+		self.add_many([(kind, project_id, id, parent, name, body)], conn=conn)
+
+	def add_many(self, docs, conn=None):
+		"""
+		Add (or update) every `(kind, project_id, id, parent, name, body)` in
+		`docs` in one transaction. `conn` is a connection that is already in a
+		transaction.
+		"""
+		self._write(conn, lambda c: [self._put(c, *doc) for doc in docs])
+
+	def add_json(self, kind, project_id, items, parent=None, conn=None):
+		"""
+		Add (or update) the documents of the raw api json `items` of `kind`.
+		Html bodies are converted to text, and the pages in a notebook's
+		abbreviated `subpages` are added by name. Comments are on the model at
+		the api path `parent`.
+		"""
+		docs = []
+		for data in items:
+			docs.extend(_json_docs(kind, project_id, data, parent))
+		if len(docs) > 0:
+			self.add_many(docs, conn=conn)
+
+	def remove(self, kind, project_id, ids, conn=None):
+		"""
+		Remove the documents of `kind` with `ids` in the project, and those of
+		their comments
+		"""
+		def remove(c):
+			for id in ids:
+				self._delete(c, "kind = ? AND project_id = ? AND model_id = ?", (kind, project_id, id))
+				if kind in ["task", "page"]:
+					self._delete(c, "parent = ?", (_model_path(kind, project_id, id),))
+		self._write(conn, remove)
+
+	def remove_comments(self, parent, keep_ids=(), conn=None):
+		"""
+		Remove the documents of the comments on the model at the api path
+		`parent`, except those in `keep_ids`
+		"""
+		keep_ids = set(keep_ids)
+		def remove(c):
+			rows = c.execute(
+				"SELECT doc_id, model_id FROM search_docs WHERE parent = ? AND kind = 'comment'", (parent,)
+			).fetchall()
+			for doc_id, model_id in rows:
+				if model_id not in keep_ids:
+					self._delete(c, "doc_id = ?", (doc_id,))
+		self._write(conn, remove)
+
+	def search(self, query, project_id=None, kinds=None, limit=20):
+		"""
+		Return the SearchHits of the documents that have every word of `query`
+		(the last one may be the start of a word), optionally only those in
+		`project_id` and of `kinds`. The best matches come first, words found
+		in names count more than words found in bodies. When more than
+		RANK_WINDOW documents match (e.g. for words found in almost every
+		document), only the most recently indexed RANK_WINDOW are ranked, the
+		older ones follow them newest first.
+		"""
+		match = _match_query(query, self.fts)
+		if match is None:
+			return []
+
+		where = ["search_fts MATCH ?"]
+		args = [match]
+		if project_id is not None:
+			where.append("d.project_id = ?")
+			args.append(project_id)
+		if kinds is not None and len(kinds) > 0:
+			where.append("d.kind IN ({})".format(", ".join("?" * len(kinds))))
+			args.extend(kinds)
+
+		conn = self._connect()
+		row = conn.execute(
+			"SELECT search_fts.rowid FROM search_fts JOIN search_docs d ON d.doc_id = search_fts.rowid"
+			" WHERE {} ORDER BY search_fts.rowid DESC LIMIT 1 OFFSET ?".format(" AND ".join(where)),
+			args + [RANK_WINDOW - 1]
+		).fetchone()
+		cutoff = None if row is None else row[0]
+
+		if self.fts == "fts5":
+			score = "bm25(search_fts, {}, 1.0)".format(NAME_WEIGHT)
+			snippet = "snippet(search_fts, 1, ?, ?, '...', 12)"
+		else:
+			conn.create_function("search_rank", 1, _fts4_rank)
+			score = "search_rank(matchinfo(search_fts, 'pcx'))"
+			snippet = "snippet(search_fts, ?, ?, '...', 1, 12)"
+
+		sql = (
+			"SELECT d.kind, d.project_id, d.model_id, d.parent, search_fts.name, {snippet}, {score} AS score"
+			" FROM search_fts JOIN search_docs d ON d.doc_id = search_fts.rowid"
+			" WHERE {where} ORDER BY {order} LIMIT ?"
+		)
+		# a negative limit is no limit
+		sql_limit = -1 if limit is None else limit
+
+		if cutoff is None:
+			rows = conn.execute(
+				sql.format(snippet=snippet, score=score, where=" AND ".join(where), order="score, d.doc_id DESC"),
+				[SNIPPET_START, SNIPPET_END] + args + [sql_limit]
+			)
+			return [SearchHit(*row) for row in rows]
+
+		rows = conn.execute(
+			sql.format(
+				snippet=snippet,
+				score=score,
+				where=" AND ".join(where + ["search_fts.rowid >= ?"]),
+				order="score, d.doc_id DESC"
+			),
+			[SNIPPET_START, SNIPPET_END] + args + [cutoff, sql_limit]
+		)
+		res = [SearchHit(*row) for row in rows]
+		if limit is not None and len(res) >= limit:
+			return res
+
+		# in rowid order, so only the returned rows are scored
+		rows = conn.execute(
+			sql.format(
+				snippet=snippet,
+				score=score,
+				where=" AND ".join(where + ["search_fts.rowid < ?"]),
+				order="search_fts.rowid DESC"
+			),
+			[SNIPPET_START, SNIPPET_END] + args + [cutoff, -1 if limit is None else limit - len(res)]
+		)
+		res.extend(SearchHit(*row) for row in rows)
+		return res
+
+	def clear(self, conn=None):
+		"""
+		Remove all documents
+		"""
+		def clear(c):
+			c.execute("DELETE FROM search_docs")
+			c.execute("DELETE FROM search_fts")
+		self._write(conn, clear)
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _own_conn(self):
+		"""
+		Return this thread's connection to the index's own database
+		"""
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			# isolation_level=None - transactions are managed explicitly
+			conn = sqlite3.connect(self.path, timeout=self._timeout, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			self._local.conn = conn
+		return conn
+
+	def _write(self, conn, fn):
+		"""
+		Call `fn` with `conn`, or in a new transaction if `conn` is None
+		"""
+		if conn is not None:
+			fn(conn)
+			return
+
+		conn = self._connect()
+		with conn:
+			conn.execute("BEGIN IMMEDIATE")
+			fn(conn)
+
+	def _put(self, conn, kind, project_id, id, parent, name, body):
+		"""
+		Add or update a single document, leaving unchanged ones alone
+		"""
+		project_id = project_id or 0
+		name = name or u""
+		# stored as text, notebook ids included
+		if parent is not None:
+			parent = unicode(parent)
+		row = conn.execute(
+			"SELECT doc_id, parent FROM search_docs WHERE kind = ? AND project_id = ? AND model_id = ?",
+			(kind, project_id, id)
+		).fetchone()
+
+		if row is None:
+			doc_id = conn.execute(
+				"INSERT INTO search_docs (kind, project_id, model_id, parent) VALUES (?, ?, ?, ?)",
+				(kind, project_id, id, parent)
+			).lastrowid
+		else:
+			doc_id = row[0]
+			old_name, old_body = conn.execute(
+				"SELECT name, body FROM search_fts WHERE rowid = ?", (doc_id,)
+			).fetchone() or (None, None)
+			if body is None:
+				body = old_body
+			if parent is None:
+				parent = row[1]
+			if old_name == name and old_body == (body or u"") and row[1] == parent:
+				return
+			if row[1] != parent:
+				conn.execute("UPDATE search_docs SET parent = ? WHERE doc_id = ?", (parent, doc_id))
+			conn.execute("DELETE FROM search_fts WHERE rowid = ?", (doc_id,))
+
+		conn.execute(
+			"INSERT INTO search_fts (rowid, name, body) VALUES (?, ?, ?)",
+			(doc_id, name, body or u"")
+		)
+
+	def _delete(self, conn, where, args):
+		doc_ids = [row[0] for row in conn.execute("SELECT doc_id FROM search_docs WHERE " + where, args)]
+		conn.executemany("DELETE FROM search_fts WHERE rowid = ?", [(d,) for d in doc_ids])
+		conn.executemany("DELETE FROM search_docs WHERE doc_id = ?", [(d,) for d in doc_ids])
+
+def html_text(html):
+	"""
+	Return the text of an html value (tags removed, entities decoded and
+	whitespace collapsed)
+	"""
+	if html is None:
+		return None
+	if isinstance(html, str):
+		html = html.decode("utf-8", "replace")
+	text = _TAG_RE.sub(u" ", html)
+	if u"&" in text:
+		text = HTMLParser.HTMLParser().unescape(text)
+	return _SPACE_RE.sub(u" ", text).strip()
+
+def project_from_path(path):
+	"""
+	Return the project id in an api path (e.g. 3 for `projects/3/tasks/5`), or None
+	"""
+	match = _PROJECT_RE.match(path or "")
+	return None if match is None else int(match.group(1))
+
+def _model_path(kind, project_id, id):
+	"""
+	Return the api path of a task or page, the parent of its comments
+	"""
+	method = "notebook_page" if kind == "page" else kind
+	return "projects/{}/{}s/{}".format(project_id, method, id)
+
+def _json_docs(kind, project_id, data, parent):
+	"""
+	Return the documents of a model's raw json
+	"""
+	if data is None:
+		return []
+
+	# tasks are selected by their task_id
+	id = data.get("task_id" if kind == "task" else "id")
+	if id is None:
+		return []
+
+	if kind == "comment":
+		if project_id is None:
+			project_id = project_from_path(parent)
+		return [(kind, project_id, id, parent, data.get("name"), html_text(data.get("body")))]
+
+	if kind == "page" and isinstance(data.get("notebook"), dict):
+		parent = data["notebook"]["id"]
+
+	docs = [(kind, project_id, id, parent, data.get("name"), html_text(data.get("body")))]
+	if kind == "notebook":
+		docs.extend(_subpage_docs(project_id, id, data.get("subpages") or []))
+	return docs
+
+def _subpage_docs(project_id, notebook_id, subpages):
+	"""
+	Return the documents of the abbreviated pages in a notebook's `subpages`,
+	which only have names
+	"""
+	docs = []
+	stack = list(subpages)
+	while len(stack) > 0:
+		page = stack.pop()
+		page_id = page.get("id")
+		if page_id is None:
+			page_id = page_id_from_permalink(page["permalink"])
+		docs.append(("page", project_id, page_id, notebook_id, page.get("name"), None))
+		stack.extend(page.get("subpages") or [])
+	return docs
+
+def _match_query(query, fts):
+	"""
+	Return the `fts` query for the words of `query`, the last of which may be
+	the start of a word, or None if it has no words
+	"""
+	if isinstance(query, str):
+		query = query.decode("utf-8", "replace")
+	# lowercase so words like OR and NOT aren't taken as operators
+	terms = _WORD_RE.findall(query.lower())
+	if len(terms) == 0:
+		return None
+	# the whole word is matched as well, so it ranks above longer words
+	terms[-1] = u"{0} OR {0}*".format(terms[-1])
+	if fts == "fts5":
+		# fts5's AND binds tighter than OR and it needs explicit ANDs before
+		# parentheses, fts4's standard syntax has neither but binds OR tighter
+		terms[-1] = u"(" + terms[-1] + u")"
+		return u" AND ".join(terms)
+	return u" ".join(terms)
+
+def _create_fts(conn):
+	"""
+	Create the full-text table if it doesn't exist. Returns the fts module it
+	uses and whether it was just created.
+	"""
+	row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'search_fts'").fetchone()
+	if row is not None:
+		return ("fts5" if "fts5" in row[0].lower() else "fts4"), False
+
+	for fts in ["fts5", "fts4"]:
+		try:
+			conn.execute(FTS_SCHEMA[fts])
+			return fts, True
+		except sqlite3.OperationalError:
+			continue
+	raise sqlite3.OperationalError("sqlite was built without full-text search (fts4 or fts5)")
+
+def _fts4_rank(matchinfo):
+	"""
+	Rank an fts4 row from its matchinfo 'pcx' blob (lower is better): the
+	number of phrases and columns, then for each phrase and column the hits in
+	this row, the hits in all rows and the number of rows with hits
+	"""
+	info = array.array("I", str(matchinfo))
+	phrases, columns = info[0], info[1]
+	score = 0.0
+	for phrase in xrange(phrases):
+		for column in xrange(columns):
+			i = 2 + 3 * (phrase * columns + column)
+			hits, total_hits = info[i], info[i + 1]
+			if hits > 0:
+				weight = NAME_WEIGHT if column == 0 else 1.0
+				score += weight * hits / float(total_hits)
+	return -score
@@ -0,0 +1,158 @@
+import json
+import re
+
+_NON_SPACE = re.compile(r'\S')
+_SPECIAL = re.compile(r'["\[\]{},]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+# decoder states
+_BEFORE = 0		# nothing but whitespace read so far
+_IN_ARRAY = 1	# inside the top-level array
+_AFTER = 2		# the top-level array has been closed
+_WHOLE = 3		# the top-level value isn't an array, decode it at the end
+
+class JsonArrayDecoder(object):
+	"""
+	Incrementally decodes a top-level json array fed to it in chunks, returning
+	each element as soon as it has been read completely. Only the element being
+	read (plus the current chunk) is held in memory.
+
+	Elements are located with a small tokenizer that only tracks strings and
+	nesting, each complete element is then decoded with `loads`. A top-level
+	value that isn't an array is buffered and decoded whole by `close`.
+	"""
+
+	def __init__(self, loads=json.loads):
+		"""
+		"""
+		self._loads = loads
+		self._buf = ""
+		self._pos = 0			# scan position in _buf
+		self._start = None		# start of the current element in _buf
+		self._depth = 0
+		self._in_string = False
+		self._state = _BEFORE
+		self._whole = []
+
+	def feed(self, data):
+		"""
+		Feed the next chunk of the response, returning a list of the elements
+		completed by it. Raises ValueError on malformed json.
+		"""
+		if self._state == _WHOLE:
+			self._whole.append(data)
+			return []
+
+		buf = self._buf + data
+		pos = self._pos
+		items = []
+
+		while True:
+			if self._in_string:
+				m = _STRING_SPECIAL.search(buf, pos)
+				if m is None:
+					pos = len(buf)
+					break
+				if m.group() == "\\":
+					if m.end() >= len(buf):
+						# wait for the escaped character
+						pos = m.start()
+						break
+					pos = m.end() + 1
+				else:
+					self._in_string = False
+					pos = m.end()
+				continue
+
+			if self._state != _IN_ARRAY:
+				m = _NON_SPACE.search(buf, pos)
+				if m is None:
+					pos = len(buf)
+					break
+				if self._state == _AFTER:
+					raise ValueError("Extra data after json array")
+				if m.group() != "[":
+					self._state = _WHOLE
+					self._whole.append(buf[m.start():])
+					self._buf = ""
+					self._pos = 0
+					return items
+				self._state = _IN_ARRAY
+				self._depth = 1
+				pos = m.end()
+				continue
+
+			if self._depth == 1 and self._start is None:
+				m = _NON_SPACE.search(buf, pos)
+				if m is None:
+					pos = len(buf)
+					break
+				c = m.group()
+				if c == "]":
+					self._depth = 0
+					self._state = _AFTER
+					pos = m.end()
+				elif c == ",":
+					raise ValueError("Unexpected ',' in json array")
+				else:
+					self._start = pos = m.start()
+				continue
+
+			m = _SPECIAL.search(buf, pos)
+			if m is None:
+				pos = len(buf)
+				break
+
+			c = m.group()
+			pos = m.end()
+			if c == '"':
+				self._in_string = True
+			elif c == "[" or c == "{":
+				self._depth += 1
+			elif self._depth == 1 and (c == "," or c == "]"):
+				items.append(self._loads(buf[self._start:m.start()]))
+				self._start = None
+				if c == "]":
+					self._depth = 0
+					self._state = _AFTER
+			elif c != ",":
+				self._depth -= 1
+
+		# drop everything before the element being read
+		keep = pos if self._start is None else self._start
+		self._buf = buf[keep:]
+		self._pos = pos - keep
+		if self._start is not None:
+			self._start = 0
+
+		return items
+
+	def close(self):
+		"""
+		Finish decoding, returning any remaining elements. Raises ValueError if
+		the array was never closed. A top-level value that wasn't an array
+		yields nothing unless it decodes to a list.
+		"""
+		if self._state == _WHOLE:
+			res = self._loads("".join(self._whole))
+			self._whole = []
+			if isinstance(res, list):
+				return res
+			return []
+
+		if self._state == _IN_ARRAY:
+			raise ValueError("Unterminated json array")
+
+		return []
+
+def iter_json_array(chunks, loads=json.loads):
+	"""
+	Yield the elements of the json array read from the byte string iterable
+	`chunks` as each one is completed. See `JsonArrayDecoder`
+	"""
+	decoder = JsonArrayDecoder(loads)
+	for chunk in chunks:
+		for item in decoder.feed(chunk):
+			yield item
+	for item in decoder.close():
+		yield item
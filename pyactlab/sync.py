@@ -0,0 +1,308 @@
+import codecs
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from pyactlab import ActLabError
+import models
+from workers import WorkerPool
+
+# the marker must be on the first line of the file, followed by json
+MARKER_RE = re.compile(r'.*\$\$actlab:\s*({.*})\s*')
+MARKER_LINE_RE = re.compile(r'.*\$\$actlab:\s*({.*}).*')
+
+class SyncItem(object):
+	"""
+	A single changed file and the model field it updates
+	"""
+
+	def __init__(self, fname, project_id, notebook_id, page_id, field, value):
+		"""
+		"""
+		self.fname = fname
+		self.project_id = project_id
+		self.notebook_id = notebook_id
+		self.page_id = page_id
+		self.field = field
+		self.value = value
+
+	@property
+	def kind(self):
+		if self.page_id is not None:
+			return "page"
+		if self.notebook_id is not None:
+			return "notebook"
+		return "project"
+
+	@property
+	def resource(self):
+		"""
+		Key of the model this item updates. Items with the same key are saved together.
+		"""
+		return (self.project_id, self.notebook_id, self.page_id)
+
+	@property
+	def key(self):
+		"""
+		Manifest key of the field this item updates
+		"""
+		return "{}:{}:{}:{}".format(
+			self.project_id,
+			"" if self.notebook_id is None else self.notebook_id,
+			"" if self.page_id is None else self.page_id,
+			self.field
+		)
+
+	def digest(self):
+		"""
+		Hash of the rendered value, ignoring leading/trailing whitespace on the
+		whole value and trailing whitespace on each line
+		"""
+		value = self.value
+		if isinstance(value, unicode):
+			value = value.encode("utf-8")
+		value = "\n".join(line.rstrip() for line in value.strip().splitlines())
+		return hashlib.sha1(value).hexdigest()
+
+class SyncManifest(object):
+	"""
+	Records a hash of the value last pushed to each (project, notebook, page,
+	field), so files whose rendered content hasn't changed aren't pushed again.
+	Stored as json, usually in `.actlab.manifest` next to the `.actlab` config.
+	"""
+
+	def __init__(self, path):
+		"""
+		"""
+		self.path = path
+		self._hashes = {}
+		self._dirty = False
+
+		if os.path.exists(path):
+			try:
+				with open(path, "rb") as f:
+					self._hashes = json.load(f).get("hashes", {})
+			except ValueError:
+				# a corrupt manifest only means everything is pushed again
+				self._hashes = {}
+
+	def is_current(self, item):
+		"""
+		Return True if `item`'s value is the same as what was last pushed
+		"""
+		return self._hashes.get(item.key) == item.digest()
+
+	def record(self, item):
+		"""
+		Record that `item`'s value has been pushed
+		"""
+		self._hashes[item.key] = item.digest()
+		self._dirty = True
+
+	def save(self):
+		"""
+		Write the manifest if it changed. The new manifest is written to a
+		temporary file first and renamed over the old one.
+		"""
+		if not self._dirty:
+			return
+
+		directory = os.path.dirname(os.path.abspath(self.path))
+		fd, tmp_path = tempfile.mkstemp(prefix=".actlab.manifest.", dir=directory)
+		try:
+			with os.fdopen(fd, "wb") as f:
+				json.dump({"version": 1, "hashes": self._hashes}, f, indent=1, sort_keys=True)
+			os.rename(tmp_path, self.path)
+		except:
+			os.remove(tmp_path)
+			raise
+		self._dirty = False
+
+class SyncEngine(object):
+	"""
+	Pushes the content of changed files to the models named by their
+	`$$actlab: {...}` markers.
+
+	All files are parsed and rendered up front. Files whose rendered value
+	matches the `manifest` are skipped, the rest are saved on a pool of at most
+	`workers` threads sharing one client. Saves are made straight from the ids
+	in the markers, only sending the updated fields, so models aren't fetched
+	first. Files that update the same model are saved together.
+	"""
+
+	def __init__(self, client, root, mirror=None, render=None, workers=8, manifest=None, force=False):
+		"""
+		`root` is the directory file names are relative to (the git root).
+		`render` converts the contents of .md files to html, files are pushed
+		as-is if it is None. `mirror` is an optional `mirror.Mirror` that saved
+		models are written through to. `manifest` is an optional SyncManifest,
+		`force` pushes files even if the manifest says they are unchanged.
+		"""
+		self.client = client
+		self.root = root
+		self.mirror = mirror
+		self.render = render
+		self.workers = workers
+		self.manifest = manifest
+		self.force = force
+
+	def run(self, fnames):
+		"""
+		Sync all of `fnames`, returning a `(synced, skipped, errors)` tuple.
+		`synced` is a list of `(fname, kind, model name)` tuples, `skipped` a list
+		of the unchanged fnames and `errors` a list of `(fname, message)` tuples.
+		"""
+		items, errors = self.collect(fnames)
+
+		skipped = []
+		if self.manifest is not None and not self.force:
+			changed = []
+			for item in items:
+				if self.manifest.is_current(item):
+					skipped.append(item.fname)
+				else:
+					changed.append(item)
+			items = changed
+
+		groups = {}
+		order = []
+		for item in items:
+			if item.resource not in groups:
+				groups[item.resource] = []
+				order.append(item.resource)
+			groups[item.resource].append(item)
+
+		synced = []
+		if len(order) == 0:
+			return synced, skipped, errors
+
+		with WorkerPool(min(self.workers, len(order)), name="pyactlab-sync") as pool:
+			futures = [(groups[r], pool.submit(self.push, groups[r])) for r in order]
+			for group, future in futures:
+				exc = future.exception()
+				if exc is not None:
+					for item in group:
+						errors.append((item.fname, "could not sync {}: {}".format(item.kind, exc)))
+					continue
+
+				name = future.result()
+				for item in group:
+					synced.append((item.fname, item.kind, name))
+					if self.manifest is not None:
+						self.manifest.record(item)
+
+		if self.manifest is not None:
+			self.manifest.save()
+
+		return synced, skipped, errors
+
+	def collect(self, fnames):
+		"""
+		Read, parse and render every file in `fnames`. Returns a `(items, errors)`
+		tuple. Files without a marker are skipped silently.
+		"""
+		items = []
+		errors = []
+		for fname in fnames:
+			try:
+				item = self.parse(fname)
+			except ValueError as e:
+				errors.append((fname, str(e)))
+				continue
+
+			if item is not None:
+				items.append(item)
+		return items, errors
+
+	def parse(self, fname):
+		"""
+		Return the SyncItem for `fname`, or None if the file has no marker or no
+		longer exists. Raises ValueError if the marker is invalid.
+		"""
+		fpath = os.path.join(self.root, fname)
+		if not os.path.isfile(fpath):
+			return None
+
+		with codecs.open(fpath, "rb", encoding="utf-8") as f:
+			contents = f.read()
+
+		match = MARKER_RE.match(contents)
+		if match is None:
+			return None
+
+		try:
+			file_conf = json.loads(match.group(1))
+		except ValueError:
+			raise ValueError("Could not parse actlab json config in file '{}'".format(fname))
+
+		if "project" not in file_conf:
+			raise ValueError("no project specified")
+		if "update" not in file_conf:
+			raise ValueError("no update field specified")
+
+		ids = {}
+		for k in ["project", "notebook", "page"]:
+			v = file_conf.get(k)
+			if v is not None and type(v) is not int:
+				raise ValueError("{} type must be int, value was '{}'".format(k, v))
+			ids[k] = v
+
+		if ids["page"] is not None and ids["notebook"] is None:
+			raise ValueError("a page also needs its notebook specified")
+
+		value = MARKER_LINE_RE.sub("", contents)
+		if fname.endswith(".md") and self.render is not None:
+			try:
+				value = self.render(value)
+			except Exception as e:
+				raise ValueError("Could not render markdown: {}".format(e))
+
+		return SyncItem(
+			fname,
+			ids["project"],
+			ids["notebook"],
+			ids["page"],
+			file_conf["update"],
+			value
+		)
+
+	def push(self, items):
+		"""
+		Save the fields of all `items` (which must update the same model) in a
+		single request. Returns the model's name.
+		"""
+		model = self._stub(items[0])
+		for item in items:
+			model[item.field] = item.value
+
+		res = getattr(self.client, "save_" + model.method)(model)
+		if res is None:
+			raise ActLabError("the server did not accept the changes")
+		model._create_fields(res)
+
+		if self.mirror is not None:
+			self.mirror.update_model(model)
+		return model.name
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _stub(self, item):
+		"""
+		Return a model that only has the ids of the model `item` updates. Unset
+		fields aren't sent when it's saved, so nothing needs to be fetched first.
+		"""
+		client = self.client
+		if item.kind == "page":
+			model = models.Page(client, {"id": item.page_id},
+				project_id=item.project_id, notebook_id=item.notebook_id)
+			# don't fetch the body when get_fields reads it, unset fields aren't sent
+			model._fetched = True
+		elif item.kind == "notebook":
+			model = models.Notebook(client, {"id": item.notebook_id}, project_id=item.project_id)
+		else:
+			model = models.Project(client, {"id": item.project_id})
+		return model
@@ -0,0 +1,170 @@
+import collections
+import re
+
+import models
+
+# permalinks of pages in a notebook's abbreviated `subpages` json
+_PERMALINK_RES = (
+	re.compile(r'^.*path_info=projects%2F[a-zA-Z0-9-]+%2Fnotebooks%2F\d+%2Fpages%2F(\d+)'),
+	re.compile(r'^.*/projects/.*/notebooks/[0-9]+/pages/([0-9]+)'),
+)
+
+def page_id_from_permalink(permalink):
+	"""
+	Extract the page id from a page's permalink. Abbreviated pages (those in the
+	`subpages` field of a notebook) only have a permalink, not an id.
+	"""
+	for regex in _PERMALINK_RES:
+		match = regex.match(permalink)
+		if match is not None:
+			return int(match.group(1))
+	raise ValueError("Could not find a page id in permalink {!r}".format(permalink))
+
+class NotebookTree(object):
+	"""
+	Index of all pages in a notebook, built from the notebook's abbreviated
+	`subpages` json. Pages can be looked up by id, and their parents, children,
+	depth and path are all available without walking the tree.
+
+	The tree is built iteratively, so notebooks of any depth can be loaded.
+	Each page's `subpages` holds its child Pages, `roots` holds the notebook's
+	top-level pages.
+	"""
+
+	def __init__(self, client, project_id, notebook_id, subpages):
+		"""
+		"""
+		self.project_id = project_id
+		self.notebook_id = notebook_id
+		self.roots = []
+
+		self._pages = {}
+		self._parents = {}
+		self._depths = {}
+
+		# (page json, parent Page or None, depth)
+		stack = [(p, None, 0) for p in reversed(subpages)]
+		while len(stack) > 0:
+			json, parent, depth = stack.pop()
+			page = self._create_page(client, json)
+
+			if parent is None:
+				self.roots.append(page)
+			else:
+				page.parent_id = parent.id
+				parent.subpages.append(page)
+
+			self._pages[page.id] = page
+			self._parents[page.id] = parent
+			self._depths[page.id] = depth
+
+			children = json.get("subpages")
+			if children:
+				stack.extend((c, page, depth + 1) for c in reversed(children))
+
+	def __len__(self):
+		return len(self._pages)
+
+	def __contains__(self, page_id):
+		return page_id in self._pages
+
+	def __getitem__(self, page_id):
+		return self._pages[page_id]
+
+	def __iter__(self):
+		return self.iter_depth_first()
+
+	def get(self, page_id, default=None):
+		"""
+		Return the page with id `page_id`, or `default` if it isn't in the notebook
+		"""
+		return self._pages.get(page_id, default)
+
+	def parent(self, page_id):
+		"""
+		Return the parent Page of `page_id`, or None for a top-level page
+		"""
+		return self._parents[page_id]
+
+	def children(self, page_id):
+		"""
+		Return the child Pages of `page_id`
+		"""
+		return self._pages[page_id].subpages
+
+	def depth(self, page_id):
+		"""
+		Return the depth of `page_id`, top-level pages are at depth 0
+		"""
+		return self._depths[page_id]
+
+	def path(self, page_id):
+		"""
+		Return the list of Pages from the top-level page down to `page_id`
+		"""
+		res = []
+		page = self._pages[page_id]
+		while page is not None:
+			res.append(page)
+			page = self._parents[page.id]
+		res.reverse()
+		return res
+
+	def find(self, path, sep="/"):
+		"""
+		Return the page at `path`, a `sep`-separated list of page names starting
+		from a top-level page, or None if there is no such page
+		"""
+		pages = self.roots
+		page = None
+		for name in path.strip(sep).split(sep):
+			for p in pages:
+				if p.name == name:
+					page = p
+					break
+			else:
+				return None
+			pages = page.subpages
+		return page
+
+	def iter_depth_first(self):
+		"""
+		Yield every page, parents before their children, in notebook order
+		"""
+		stack = [iter(self.roots)]
+		while len(stack) > 0:
+			for page in stack[-1]:
+				yield page
+				if page.subpages:
+					stack.append(iter(page.subpages))
+					break
+			else:
+				stack.pop()
+
+	def iter_breadth_first(self):
+		"""
+		Yield every page, level by level
+		"""
+		queue = collections.deque(self.roots)
+		while len(queue) > 0:
+			page = queue.popleft()
+			yield page
+			queue.extend(page.subpages)
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _create_page(self, client, json):
+		if "id" not in json:
+			json["id"] = page_id_from_permalink(json["permalink"])
+
+		page = models.Page.create_lazy(
+			client,
+			json,
+			project_id=self.project_id,
+			notebook_id=self.notebook_id
+		)
+		# children are added by the tree
+		page.subpages = []
+		return page
@@ -0,0 +1,207 @@
+import Queue
+import threading
+import time
+
+class TimeoutError(Exception): pass
+
+class Future(object):
+	"""
+	The pending result of a call submitted to a WorkerPool
+	"""
+
+	def __init__(self):
+		"""
+		"""
+		self._done = threading.Event()
+		self._lock = threading.Lock()
+		self._result = None
+		self._exception = None
+		self._callbacks = []
+
+	def done(self):
+		"""
+		Return True if the call has finished (successfully or not)
+		"""
+		return self._done.is_set()
+
+	def wait(self, timeout=None):
+		"""
+		Wait for the call to finish. Return True if it finished within `timeout`
+		"""
+		self._done.wait(timeout)
+		return self._done.is_set()
+
+	def result(self, timeout=None):
+		"""
+		Return the result of the call, waiting up to `timeout` seconds for it. If
+		the call raised an exception, it is re-raised here.
+		"""
+		if not self.wait(timeout):
+			raise TimeoutError("Call did not finish within {} seconds".format(timeout))
+
+		if self._exception is not None:
+			raise self._exception
+		return self._result
+
+	def exception(self, timeout=None):
+		"""
+		Return the exception raised by the call, or None
+		"""
+		if not self.wait(timeout):
+			raise TimeoutError("Call did not finish within {} seconds".format(timeout))
+		return self._exception
+
+	def add_done_callback(self, fn):
+		"""
+		Call `fn(future)` once the call has finished. If it has already finished,
+		`fn` is called immediately.
+		"""
+		with self._lock:
+			if not self._done.is_set():
+				self._callbacks.append(fn)
+				return
+		fn(self)
+
+	def set_result(self, result):
+		"""
+		Mark the call as finished with `result`
+		"""
+		self._result = result
+		self._finish()
+
+	def set_exception(self, exception):
+		"""
+		Mark the call as finished with the raised `exception`
+		"""
+		self._exception = exception
+		self._finish()
+
+	def _finish(self):
+		"""
+		Wake up anything waiting on the future and run the done callbacks
+		"""
+		with self._lock:
+			self._done.set()
+			callbacks = self._callbacks
+			self._callbacks = []
+
+		for fn in callbacks:
+			fn(self)
+
+class WorkerPool(object):
+	"""
+	A fixed-size pool of worker threads. At most `size` submitted calls run at
+	the same time; everything else waits in the queue, so submitting thousands
+	of calls does not create thousands of threads.
+	"""
+
+	_stop = object()
+
+	def __init__(self, size=8, name="pyactlab-worker"):
+		"""
+		"""
+		if size < 1:
+			raise ValueError("WorkerPool size must be at least 1")
+
+		self.size = size
+		self._name = name
+		self._queue = Queue.Queue()
+		self._threads = []
+		self._lock = threading.Lock()
+		self._shutdown = False
+
+	def submit(self, fn, *args, **kwargs):
+		"""
+		Schedule `fn(*args, **kwargs)` to be run by a worker and return its Future
+		"""
+		future = Future()
+		with self._lock:
+			if self._shutdown:
+				raise RuntimeError("Can not submit to a WorkerPool that has been shut down")
+			self._start_workers()
+			self._queue.put((future, fn, args, kwargs))
+		return future
+
+	def map(self, fn, items):
+		"""
+		Submit `fn(item)` for each item and return the list of Futures, in the same
+		order as `items`
+		"""
+		return [self.submit(fn, item) for item in items]
+
+	def shutdown(self, wait=True, timeout=None):
+		"""
+		Stop the workers once the queued calls have finished. If `wait` is True,
+		wait for them to stop, for at most `timeout` seconds if it isn't None.
+		"""
+		with self._lock:
+			if self._shutdown:
+				return
+			self._shutdown = True
+			threads = self._threads
+
+		for t in threads:
+			self._queue.put(self._stop)
+
+		if wait:
+			deadline = None if timeout is None else time.time() + timeout
+			for t in threads:
+				if deadline is None:
+					t.join()
+				else:
+					t.join(max(0, deadline - time.time()))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.shutdown(wait=True)
+
+	# ---------------------------------
+	# PRIVATE
+	# ---------------------------------
+
+	def _start_workers(self):
+		"""
+		Start the worker threads the first time something is submitted
+		"""
+		while len(self._threads) < self.size:
+			t = threading.Thread(
+				target=self._work,
+				name="{}-{}".format(self._name, len(self._threads))
+			)
+			t.daemon = True
+			t.start()
+			self._threads.append(t)
+
+	def _work(self):
+		"""
+		Run queued calls until told to stop
+		"""
+		while True:
+			item = self._queue.get()
+			if item is self._stop:
+				return
+
+			future, fn, args, kwargs = item
+			try:
+				res = fn(*args, **kwargs)
+			except Exception as e:
+				future.set_exception(e)
+			else:
+				future.set_result(res)
+
+def gather(futures, return_exceptions=False, timeout=None):
+	"""
+	Wait for all `futures` and return their results in the same order. If
+	`return_exceptions` is True, raised exceptions are returned in place of
+	results instead of being re-raised.
+	"""
+	results = []
+	for future in futures:
+		if return_exceptions:
+			exc = future.exception(timeout)
+			results.append(exc if exc is not None else future.result())
+		else:
+			results.append(future.result(timeout))
+	return results
@@ -37,11 +37,16 @@ setup(
                 "html2text",
                 "markdown",
 	],
+	extras_require = {
+		# faster json decoding of api responses
+		"ujson": ["ujson"],
+	},
     classifiers = [
         'Programming Language :: Python :: 2',
     ],
     scripts = [
         os.path.join("bin", "actlab"),
+        os.path.join("bin", "actlabd"),
     ],
     packages = [
         "pyactlab", "pyactlab.misc"